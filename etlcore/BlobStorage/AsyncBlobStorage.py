@@ -0,0 +1,170 @@
+import io
+import os
+import time
+import asyncio
+import aiohttp
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.storage.blob.aio import BlobServiceClient
+
+from etlcore.BlobStorage.BlobStorage import BLOCK_SIZE
+from etlcore.S3.S3Bulk import BulkResult
+
+MAX_CONCURRENCY = 16
+LIST_PAGE_SIZE = 5000  # the most a list blobs call returns
+DELETE_BATCH_SIZE = 256  # the most sub requests one blob batch accepts
+
+
+# asyncio version of BlobStorage built on azure.storage.blob.aio
+# every container and blob client comes from one service client, so they all share one pooled aiohttp transport
+class AsyncBlobStorage:
+
+    # max_concurrency bounds the blobs in flight for the bulk operations, max_connections the transport's connection pool
+    def __init__(self, connection_string: str, max_concurrency: int = MAX_CONCURRENCY, max_connections: int = 100,
+                 block_size: int = BLOCK_SIZE) -> None:
+
+        self.connection_string = connection_string
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self.block_size = block_size
+        self.blob_service_client = None
+
+    # Creates the client and opens the transport, use instead of the constructor when not using "async with"
+    @classmethod
+    async def create(cls, connection_string: str, *args, **kwargs):
+        blob_storage = cls(connection_string, *args, **kwargs)
+        await blob_storage.open()
+        return blob_storage
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    # the aiohttp session has to be created inside the running event loop
+    async def open(self) -> None:
+
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_connections))
+        self.blob_service_client = BlobServiceClient.from_connection_string(
+            conn_str=self.connection_string,
+            transport=AioHttpTransport(session=session, session_owner=True),
+            max_block_size=self.block_size,
+            max_single_put_size=self.block_size,
+            max_chunk_get_size=self.block_size)
+
+    async def close(self) -> None:
+
+        if self.blob_service_client is not None:
+            await self.blob_service_client.close()
+
+    # yields BlobProperties for every blob under prefix, page by page
+    async def list_blobs(self, container_name: str, prefix: str = None, page_size: int = LIST_PAGE_SIZE):
+
+        container_client = self.blob_service_client.get_container_client(container_name)
+        async for blob in container_client.list_blobs(name_starts_with=prefix, results_per_page=page_size):
+            yield blob
+
+    async def list_blob_names(self, container_name: str, prefix: str = None) -> list:
+
+        return [blob.name async for blob in self.list_blobs(container_name, prefix)]
+
+    async def get_file(self, file_path: str, container_name: str):
+
+        blob_client = self.blob_service_client.get_blob_client(
+            container_name, file_path)
+        stream = io.BytesIO()
+        downloader = await blob_client.download_blob()
+        await downloader.readinto(stream)
+
+        return stream
+
+    async def download_to_file(self, container_name: str, blob_name: str, local_file_path: str):
+
+        blob_client = self.blob_service_client.get_blob_client(
+            container_name, blob_name)
+        with open(local_file_path, "wb") as file_content:
+            downloader = await blob_client.download_blob()
+            await downloader.readinto(file_content)
+
+        return local_file_path
+
+    async def upload_blob(self, container_name: str, file_path: str, overwrite: bool = False, blob_name: str = None):
+
+        blob_client = self.blob_service_client.get_blob_client(
+            container_name, blob_name or file_path)
+        with open(file_path, "rb") as file_content:
+            await blob_client.upload_blob(file_content, length=os.path.getsize(file_path), overwrite=overwrite)
+
+    async def delete_blob(self, container_name: str, blob_name: str):
+
+        blob_client = self.blob_service_client.get_blob_client(
+            container_name, blob_name)
+        await blob_client.delete_blob()
+
+    # downloads every blob into local_dir (keeping the blob's folders), at most max_concurrency at a time
+    async def download_many(self, container_name: str, blob_names: list, local_dir: str) -> BulkResult:
+
+        async def download(blob_name):
+            local_file_path = os.path.join(local_dir, *blob_name.split("/"))
+            os.makedirs(os.path.dirname(local_file_path) or ".", exist_ok=True)
+            await self.download_to_file(container_name, blob_name, local_file_path)
+
+        return await self._run_bounded("download", blob_names, download)
+
+    # uploads every file as blob_prefix + its file name, at most max_concurrency at a time
+    async def upload_many(self, container_name: str, file_paths: list, blob_prefix: str = "", overwrite: bool = False) -> BulkResult:
+
+        async def upload(file_path):
+            await self.upload_blob(container_name, file_path, overwrite, blob_prefix + os.path.basename(file_path))
+
+        return await self._run_bounded("upload", file_paths, upload)
+
+    # deletes through the blob batch API, 256 blobs per request, with several batches in flight
+    async def delete_many(self, container_name: str, blob_names: list) -> BulkResult:
+
+        start = time.perf_counter()
+        container_client = self.blob_service_client.get_container_client(container_name)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        result = BulkResult("delete")
+
+        async def delete_batch(batch):
+            async with semaphore:
+                try:
+                    responses = await container_client.delete_blobs(*batch, raise_on_any_failure=False)
+                    statuses = [response.status_code async for response in responses]
+                except Exception as e:
+                    result.failed.update({blob_name: str(e) for blob_name in batch})
+                    return
+            for blob_name, status in zip(batch, statuses):
+                if status in (202, 404):  # already gone counts as deleted
+                    result.succeeded.append(blob_name)
+                else:
+                    result.failed[blob_name] = f"HTTP {status}"
+
+        batches = [blob_names[i:i + DELETE_BATCH_SIZE] for i in range(0, len(blob_names), DELETE_BATCH_SIZE)]
+        await asyncio.gather(*(delete_batch(batch) for batch in batches))
+        result.seconds = time.perf_counter() - start
+        return result
+
+    async def delete_prefix(self, container_name: str, prefix: str) -> BulkResult:
+
+        return await self.delete_many(container_name, await self.list_blob_names(container_name, prefix))
+
+    async def _run_bounded(self, operation: str, items: list, action) -> BulkResult:
+
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        result = BulkResult(operation)
+
+        async def run(item):
+            async with semaphore:
+                try:
+                    await action(item)
+                    result.succeeded.append(item)
+                except Exception as e:
+                    result.failed[item] = str(e)
+
+        await asyncio.gather(*(run(item) for item in items))
+        result.seconds = time.perf_counter() - start
+        return result
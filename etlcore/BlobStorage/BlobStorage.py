@@ -1,14 +1,31 @@
 import io
-from azure.storage.blob import BlobServiceClient
+import os
+import uuid
+import base64
+import threading
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from azure.core import MatchConditions
+from azure.storage.blob import BlobServiceClient, BlobBlock
+
+BLOCK_SIZE = 8 * 1024 * 1024
+MAX_CONCURRENCY = 4
 
 
 class BlobStorage:
 
-    def __init__(self, connection_string: str) -> None:
+    # block_size is used for staged uploads and ranged downloads, max_concurrency is how many blocks/ranges move at once
+    def __init__(self, connection_string: str, block_size: int = BLOCK_SIZE, max_concurrency: int = MAX_CONCURRENCY) -> None:
 
+        self.block_size = block_size
+        self.max_concurrency = max_concurrency
         try:
             self.blob_service_client = BlobServiceClient.from_connection_string(
-                conn_str=connection_string)
+                conn_str=connection_string,
+                max_block_size=block_size,
+                max_single_put_size=block_size,
+                max_chunk_get_size=block_size)
         except:
             print("The connection to blob storage failed")
 
@@ -17,7 +34,7 @@ class BlobStorage:
         blob_client = self.blob_service_client.get_blob_client(
             container_name, file_path)
         stream = io.BytesIO()
-        blob_client.download_blob().readinto(stream)
+        blob_client.download_blob(max_concurrency=self.max_concurrency).readinto(stream)
 
         return stream
 
@@ -27,10 +44,96 @@ class BlobStorage:
             container_name, blob_name)
         blob_client.delete_blob()
 
-    def upload_blob(self, container_name: str, file_path: str, overwrite: bool = False):
+    # streams the file from disk, blocks over block_size are staged in parallel instead of reading the whole file first
+    def upload_blob(self, container_name: str, file_path: str, overwrite: bool = False, blob_name: str = None):
 
         blob_client = self.blob_service_client.get_blob_client(
-            container_name, file_path
+            container_name, blob_name or file_path
         )
         with open(file_path, "rb") as file_content:
-            blob_client.upload_blob(file_content.read(), overwrite=overwrite)
+            blob_client.upload_blob(file_content, length=os.path.getsize(file_path),
+                                    overwrite=overwrite, max_concurrency=self.max_concurrency)
+
+    # data is a binary file handle or an iterator of bytes (e.g. a generator producing an export)
+    # iterators are cut into block_size blocks that are staged on a thread pool, with at most max_concurrency blocks held in memory
+    def upload_stream(self, container_name: str, blob_name: str, data, overwrite: bool = False):
+
+        blob_client = self.blob_service_client.get_blob_client(
+            container_name, blob_name)
+        if hasattr(data, "read"):
+            blob_client.upload_blob(data, overwrite=overwrite, max_concurrency=self.max_concurrency)
+            return
+
+        prefix = uuid.uuid4().hex  # block ids must all have the same length
+        block_ids = []
+        futures = deque()
+        slots = threading.Semaphore(self.max_concurrency)
+
+        def stage(block_id, block):
+            try:
+                blob_client.stage_block(block_id, block, length=len(block))
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            for block in _blocks(data, self.block_size):
+                slots.acquire()
+                block_id = base64.b64encode(f"{prefix}{len(block_ids):08d}".encode()).decode()
+                block_ids.append(block_id)
+                futures.append(pool.submit(stage, block_id, block))
+                while futures and futures[0].done():
+                    futures.popleft().result()  # surface a failed block early
+            for future in futures:
+                future.result()
+
+        conditions = {} if overwrite else {"etag": "*", "match_condition": MatchConditions.IfMissing}
+        blob_client.commit_block_list([BlobBlock(block_id=block_id) for block_id in block_ids], **conditions)
+
+    def download_to_file(self, container_name: str, blob_name: str, local_file_path: str):
+
+        blob_client = self.blob_service_client.get_blob_client(
+            container_name, blob_name)
+        with open(local_file_path, "wb") as file_content:
+            blob_client.download_blob(max_concurrency=self.max_concurrency).readinto(file_content)
+
+        return local_file_path
+
+    # yields the blob in block_size pieces, in order, while the next max_concurrency ranges are already downloading
+    def iter_blob(self, container_name: str, blob_name: str):
+
+        blob_client = self.blob_service_client.get_blob_client(
+            container_name, blob_name)
+        size = blob_client.get_blob_properties().size
+        offsets = iter(range(0, size, self.block_size))
+
+        def fetch(offset):
+            return blob_client.download_blob(offset=offset, length=min(self.block_size, size - offset)).readall()
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            pending = deque(pool.submit(fetch, offset) for offset in islice(offsets, self.max_concurrency))
+            while pending:
+                chunk = pending.popleft().result()
+                for offset in islice(offsets, 1):
+                    pending.append(pool.submit(fetch, offset))
+                yield chunk
+
+    # reads length bytes from offset, a negative offset counts from the end of the blob (e.g. -8 for a parquet footer length)
+    def read_range(self, container_name: str, blob_name: str, offset: int, length: int = None) -> bytes:
+
+        blob_client = self.blob_service_client.get_blob_client(
+            container_name, blob_name)
+        if offset < 0:
+            offset = max(blob_client.get_blob_properties().size + offset, 0)
+        return blob_client.download_blob(offset=offset, length=length).readall()
+
+
+# regroups an iterator of byte strings of any size into block_size blocks (the last one may be shorter)
+def _blocks(data, block_size: int):
+    buffer = bytearray()
+    for piece in data:
+        buffer += piece
+        while len(buffer) >= block_size:
+            yield bytes(buffer[:block_size])
+            del buffer[:block_size]
+    if buffer:
+        yield bytes(buffer)
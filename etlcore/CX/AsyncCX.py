@@ -0,0 +1,124 @@
+import time, asyncio, contextlib
+import httpx
+
+from etlcore.CX.CX import CX, extractVerificationToken
+
+#asyncio version of CX built on httpx, one AsyncClient holds the cookies and pooled connections for every request
+class AsyncCX:
+    _loginPeriod = CX._loginPeriod
+    _touchbackMargin = CX._touchbackMargin
+
+    #maxConnections: upper bound on simultaneous connections to CX from this client
+    def __init__(self, URL: str, Username: str, Password: str, *args, **kwargs) -> None:
+        self.isLoggedIn = False
+        self.logoutTime = 0
+        self.URL = URL[:-1] # url ex from keyvault = https://cdnycx.nyiddccohh.net/ or https://phpcx.medisked.net/
+        self.Username = Username
+        self.Password = Password
+
+        self.client = httpx.AsyncClient(
+            headers=kwargs.get("sessionHeaders", {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/76.0.3809.87 Safari/537.36"}),
+            follow_redirects=True, # requests follows redirects by default, httpx does not
+            timeout=kwargs.get("timeout", httpx.Timeout(60.0)),
+            limits=httpx.Limits(max_connections=kwargs.get("maxConnections", 10)),
+        )
+        self._lock = asyncio.Lock() # one login/refresh at a time across tasks
+        self.stats = {"logins": 0, "relogins": 0, "touchbacks": 0, "avoidedTouchbacks": 0}
+
+    #Creates the client and logs in, use instead of the constructor when not using "async with"
+    @classmethod
+    async def create(cls, URL: str, Username: str, Password: str, *args, **kwargs):
+        cx = cls(URL, Username, Password, *args, **kwargs)
+        await cx.login()
+        return cx
+
+    async def __aenter__(self):
+        await self.login()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+    #This method creates session with Medisked and initializes a countdown timer
+    async def login(self) -> bool:
+        async with self._lock:
+            return await self._login()
+
+    async def _login(self) -> bool:
+        response = await self.client.get("{}/Account/Login".format(self.URL))
+        rvt = extractVerificationToken(response.content) # find the RVT (Request Verification Token)
+
+        # authenticate
+        response = await self.client.post("{}/Account/Login".format(self.URL),
+                data={"__RequestVerificationToken": rvt,
+                      "Username": self.Username,
+                      "Password": self.Password,
+                      "IsMsLogin": "false",
+                      "AcceptTerms": "true",
+                    },
+            )
+        if response.is_success:
+            self.logoutTime = time.time() + self._loginPeriod
+            self.isLoggedIn = True
+            self.stats["logins"] += 1
+
+        return response.is_success
+
+    #Same policy as CX.refreshSession, touch back only when the session is close to expiring and log in again if the
+    #touchback lands on the login page
+    async def refreshSession(self) -> None:
+        async with self._lock:
+            remaining = self.logoutTime - time.time()
+            if remaining <= 0:
+                await self._login()
+            elif remaining > self._touchbackMargin:
+                self.stats["avoidedTouchbacks"] += 1
+            else:
+                # Refresh our session
+                response = await self.client.post("{}/Home/Touchback".format(self.URL))
+                self.stats["touchbacks"] += 1
+                if self._sessionLapsed(response):
+                    self.stats["relogins"] += 1
+                    await self._login()
+                else:
+                    self.logoutTime = time.time() + self._loginPeriod
+
+    #CX answers requests from a lapsed session by redirecting to the login page
+    def _sessionLapsed(self, response: httpx.Response) -> bool:
+        return response.status_code == 401 or "/Account/Login" in response.url.path
+
+    #Waits for the lock and logs in again unless another task already did since logoutTime was read
+    async def _reloginIfUnchanged(self, logoutTime: float) -> None:
+        async with self._lock:
+            if self.logoutTime == logoutTime:
+                self.stats["relogins"] += 1
+                await self._login()
+
+    #Sends a request and, if CX redirected it to the login page, logs in again (once across concurrent tasks) and
+    #retries once, raises if the retry still lands on the login page
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        logoutTime = self.logoutTime
+        response = await self.client.request(method, url, **kwargs)
+        if self._sessionLapsed(response):
+            await self._reloginIfUnchanged(logoutTime)
+            response = await self.client.request(method, url, **kwargs)
+            if self._sessionLapsed(response):
+                raise Exception("CX session is still lapsed after logging in again: {} {}".format(method, url))
+        return response
+
+    #Same as request() but leaves the body unread, use as "async with cx.stream(...) as response:"
+    @contextlib.asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs):
+        logoutTime = self.logoutTime
+        async with self.client.stream(method, url, **kwargs) as response:
+            if not self._sessionLapsed(response):
+                yield response
+                return
+        await self._reloginIfUnchanged(logoutTime)
+        async with self.client.stream(method, url, **kwargs) as response:
+            if self._sessionLapsed(response):
+                raise Exception("CX session is still lapsed after logging in again: {} {}".format(method, url))
+            yield response
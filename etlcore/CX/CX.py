@@ -1,11 +1,109 @@
-import time
-from requests import Session
+import os, re, time, json, html, tempfile, threading, contextlib
+from typing import Optional
+from requests import Response, Session
 from bs4 import BeautifulSoup
 
+_TOKEN_TAG = re.compile(rb"""<input[^>]*name=["']__RequestVerificationToken["'][^>]*>""", re.IGNORECASE)
+_TOKEN_VALUE = re.compile(rb"""value=["']([^"']*)["']""", re.IGNORECASE)
+
+#Finds the __RequestVerificationToken with a regex over the raw page instead of building a full lxml tree
+def extractVerificationToken(content: bytes) -> str:
+    tag = _TOKEN_TAG.search(content)
+    if tag:
+        value = _TOKEN_VALUE.search(tag.group(0))
+        if value:
+            return html.unescape(value.group(1).decode())
+    # fall back to a full parse in case the markup ever changes shape
+    bs = BeautifulSoup(content, "lxml")
+    return bs.find(attrs={"name": "__RequestVerificationToken"}).attrs["value"]
+
+
+_storeLocks = {}
+_storeLocksGuard = threading.Lock()
+
+#one lock per store file shared by every SessionStore in this process, each CX with sessionStore="path" builds its own store
+def _storeLock(path: str) -> threading.Lock:
+    with _storeLocksGuard:
+        return _storeLocks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+class SessionStore:
+    """Saves CX cookie jars and logout times to a local file so other processes can reuse a session while it is still valid"""
+    _minRemaining = 60 # don't hand out a session that is about to expire
+    _staleLock = 30 # a lock file older than this was left behind by a process that died while writing
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = _storeLock(path)
+
+    #holds the store for one read-modify-write: the thread lock covers this process, a lock file created with O_EXCL
+    #covers other processes so their entries aren't lost between our read and our write
+    @contextlib.contextmanager
+    def _locked(self):
+        lockPath = self.path + ".lock"
+        with self._lock:
+            while True:
+                try:
+                    fd = os.open(lockPath, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+                    break
+                except FileExistsError:
+                    try:
+                        if time.time() - os.path.getmtime(lockPath) > self._staleLock:
+                            os.remove(lockPath)
+                            continue
+                    except OSError:
+                        continue # released between the two calls
+                    time.sleep(0.05)
+            try:
+                yield
+            finally:
+                os.close(fd)
+                os.remove(lockPath)
+
+    def _key(self, url: str, username: str) -> str:
+        return "{}|{}".format(url, username)
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, entries: dict) -> None:
+        # mkstemp gives every writer its own temp file, created 0600 since cookies are credentials
+        fd, tmpPath = tempfile.mkstemp(prefix=os.path.basename(self.path) + ".", suffix=".tmp", dir=os.path.dirname(os.path.abspath(self.path)))
+        with os.fdopen(fd, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmpPath, self.path)
+
+    #Returns the stored {"logoutTime", "cookies"} entry or None when there is nothing usable
+    def load(self, url: str, username: str) -> Optional[dict]:
+        entry = self._read().get(self._key(url, username))
+        if entry is None or entry.get("logoutTime", 0) - time.time() < self._minRemaining:
+            return None
+        return entry
+
+    def save(self, url: str, username: str, session: Session, logoutTime: float) -> None:
+        cookies = [{"name": c.name, "value": c.value, "domain": c.domain, "path": c.path, "expires": c.expires, "secure": c.secure}
+                   for c in session.cookies]
+        with self._locked():
+            entries = self._read()
+            entries[self._key(url, username)] = {"logoutTime": logoutTime, "cookies": cookies}
+            self._write(entries)
+
+    def clear(self, url: str, username: str) -> None:
+        with self._locked():
+            entries = self._read()
+            if entries.pop(self._key(url, username), None) is not None:
+                self._write(entries)
+
 #This class represents all of the functionality that is needed for getting Data Exports out of Medisked Connect Exchange.
 class CX:
     _loginPeriod = 1080  # 18 minutes
+    _touchbackMargin = 300  # only touch back once the session is within 5 minutes of expiring
 
+    #sessionStore: optional SessionStore (or path to one) used to reuse a still valid session instead of logging in again
     def __init__(self, URL: str, Username: str, Password: str, *args, **kwargs) -> None:
         self.isLoggedIn = False
         self.exports = None
@@ -14,15 +112,42 @@ class CX:
         self.Password = Password
 
         self.session = Session()
+        self._lock = threading.RLock() # guards login/refresh when the session is shared between threads
+        self._keepaliveStop = None
+        self.stats = {"logins": 0, "relogins": 0, "touchbacks": 0, "avoidedTouchbacks": 0}
         self.session.headers.update(kwargs.get("sessionHeaders", {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/76.0.3809.87 Safari/537.36"},))
 
-        self.login()
+        store = kwargs.get("sessionStore", None)
+        self.sessionStore = SessionStore(store) if isinstance(store, str) else store
+
+        if not self.restoreSession():
+            self.login()
+
+    #Loads cookies and logoutTime from the session store, returns False when there is no valid stored session
+    def restoreSession(self) -> bool:
+        if self.sessionStore is None:
+            return False
+        entry = self.sessionStore.load(self.URL, self.Username)
+        if entry is None:
+            return False
+        for c in entry["cookies"]:
+            self.session.cookies.set(c["name"], c["value"], domain=c["domain"], path=c["path"], expires=c["expires"], secure=c["secure"])
+        self.logoutTime = entry["logoutTime"]
+        self.isLoggedIn = True
+        return True
+
+    def _saveSession(self) -> None:
+        if self.sessionStore is not None:
+            self.sessionStore.save(self.URL, self.Username, self.session, self.logoutTime)
 
     #This method creates session with Medisked and initializes a countdown timer
     def login(self):
+        with self._lock:
+            return self._login()
+
+    def _login(self):
         response = self.session.get("{}/Account/Login".format(self.URL))
-        bs = BeautifulSoup(response.content, "lxml") # find the RVT (Request Verification Token)
-        rvt = bs.find(attrs={"name": "__RequestVerificationToken"}).attrs["value"]
+        rvt = extractVerificationToken(response.content) # find the RVT (Request Verification Token)
 
         # authenticate
         response = self.session.post("{}/Account/Login".format(self.URL),
@@ -36,14 +161,106 @@ class CX:
         if response.ok:
             self.logoutTime = time.time() + self._loginPeriod   # get the current time
             self.isLoggedIn = True
+            self.stats["logins"] += 1
+            self._saveSession()
+        elif self.sessionStore is not None:
+            self.sessionStore.clear(self.URL, self.Username)
 
         return response.ok
     
+    #Keeps the session alive: logs in again once it has expired, touches back only when it is close to expiring
+    #and otherwise skips the round trip entirely. a touchback that lands on the login page logs in again instead
     def refreshSession(self) -> None:
-        if time.time() - self.logoutTime > CX._loginPeriod:
-            self.login()
-        else:
-            # Refresh our session
-            self.session.post("{}/Home/Touchback".format(self.URL))
-            self.logoutTime = time.time() + self._loginPeriod
-            
\ No newline at end of file
+        with self._lock:
+            remaining = self.logoutTime - time.time()
+            if remaining <= 0:
+                self.login()
+            elif remaining > self._touchbackMargin:
+                self.stats["avoidedTouchbacks"] += 1
+            else:
+                # Refresh our session
+                response = self.session.post("{}/Home/Touchback".format(self.URL))
+                response.close()
+                self.stats["touchbacks"] += 1
+                if self._sessionLapsed(response):
+                    self.stats["relogins"] += 1
+                    self._login()
+                else:
+                    self.logoutTime = time.time() + self._loginPeriod
+                    self._saveSession()
+
+    #CX answers requests from a lapsed session by redirecting to the login page
+    def _sessionLapsed(self, response: Response) -> bool:
+        return response.status_code == 401 or "/Account/Login" in response.url
+
+    #Sends a request on the shared session and, if CX shows the session has lapsed, logs in again and retries once
+    #when several threads see the lapse together only the first one logs in, the others find logoutTime already moved
+    #and just retry. raises if the retry still lands on the login page so it is never mistaken for a real response
+    def request(self, method: str, url: str, **kwargs) -> Response:
+        logoutTime = self.logoutTime
+        response = self.session.request(method, url, **kwargs)
+        if self._sessionLapsed(response):
+            response.close()
+            with self._lock:
+                if self.logoutTime == logoutTime: # nobody renewed the session since this request was sent
+                    self.stats["relogins"] += 1
+                    self._login()
+            response = self.session.request(method, url, **kwargs)
+            if self._sessionLapsed(response):
+                response.close()
+                raise Exception("CX session is still lapsed after logging in again: {} {}".format(method, url))
+        return response
+
+    #Starts a daemon thread that calls refreshSession every interval seconds, for long idle waits between calls
+    def startKeepalive(self, interval: int = 60) -> None:
+        if self._keepaliveStop is not None:
+            return
+        self._keepaliveStop = threading.Event()
+
+        def keepalive(stop: threading.Event):
+            while not stop.wait(interval):
+                try:
+                    self.refreshSession()
+                except Exception as e:
+                    print("CX keepalive failed: {}".format(str(e)))
+
+        threading.Thread(target=keepalive, args=(self._keepaliveStop,), daemon=True).start()
+
+    def stopKeepalive(self) -> None:
+        if self._keepaliveStop is not None:
+            self._keepaliveStop.set()
+            self._keepaliveStop = None
+
+
+#Compares CX start up without a stored session (cold) against start up that reuses one (warm)
+#returns the mean seconds per construction for each, plus the time to pull the token out of the login page both ways
+def benchmarkStartup(URL: str, Username: str, Password: str, storePath: str, runs: int = 3) -> dict:
+    cold = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        CX(URL, Username, Password)
+        cold.append(time.perf_counter() - start)
+
+    store = SessionStore(storePath)
+    store.clear(URL[:-1], Username)
+    CX(URL, Username, Password, sessionStore=store) # seed the store
+    warm = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        CX(URL, Username, Password, sessionStore=store)
+        warm.append(time.perf_counter() - start)
+
+    page = Session().get("{}/Account/Login".format(URL[:-1])).content
+    start = time.perf_counter()
+    for _ in range(runs):
+        extractVerificationToken(page)
+    tokenRegex = (time.perf_counter() - start) / runs
+    start = time.perf_counter()
+    for _ in range(runs):
+        BeautifulSoup(page, "lxml").find(attrs={"name": "__RequestVerificationToken"}).attrs["value"]
+    tokenSoup = (time.perf_counter() - start) / runs
+
+    return {"coldStart": sum(cold) / runs,
+            "warmStart": sum(warm) / runs,
+            "tokenRegex": tokenRegex,
+            "tokenSoup": tokenSoup}
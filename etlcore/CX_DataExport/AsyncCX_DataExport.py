@@ -0,0 +1,162 @@
+import os, time, bz2, json, asyncio
+from typing import Dict, List, Tuple, Union
+
+from etlcore.CX.AsyncCX import AsyncCX
+from etlcore.CX.CX import extractVerificationToken
+from etlcore.CX_DataExport.CX_DataExport import DataExport, ReportCatalog, exportTimestamp, exportFileName, DOWNLOAD_CHUNK_SIZE, EXPORT_LIST_PAGE_SIZE
+from pandas import DataFrame, read_csv
+from io import BytesIO
+
+
+#asyncio version of CX_Utils, use "async with AsyncCX_Utils(...) as cx_util:" to log in and load the report catalog
+class AsyncCX_Utils:
+
+    #catalogCache/catalogTTL: optional path of a local report catalog cache and how many seconds it stays valid
+    def __init__(self, URL: str, Username: str, Password: str, *args, **kwargs):
+        self.url = URL
+        self.username = Username
+        self.password = Password
+        self.catalogCache = kwargs.get("catalogCache", None)
+        self.catalogTTL = kwargs.get("catalogTTL", 3600)
+        self.cx_object = AsyncCX(URL, Username, Password, **kwargs)
+        self.catalog = None
+
+    async def __aenter__(self):
+        await self.cx_object.login()
+        self.catalog = ReportCatalog.load(self.catalogCache, self.catalogTTL) if self.catalogCache else None
+        if self.catalog is None:
+            await self.refreshCatalog()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.cx_object.close()
+
+    @property
+    def report_list(self) -> List[DataExport]:
+        return self.catalog.exports
+
+    #Reloads every export from CX and rewrites the cache file when one is configured
+    async def refreshCatalog(self) -> ReportCatalog:
+        self.catalog = ReportCatalog(await self.getReportList())
+        if self.catalogCache:
+            self.catalog.save(self.catalogCache)
+        return self.catalog
+
+    #Returns the raw export records as CX reports them, paging until a short page comes back or CX's reported Total has been read
+    async def readExportList(self, pageSize: int = EXPORT_LIST_PAGE_SIZE) -> List[dict]:
+        records = []
+        page = 1
+        while True:
+            response = await self.cx_object.request("POST", "{}/Reporting/DataExportList_Read".format(self.url), data={"page": page, "pageSize": pageSize})
+            result = json.loads(response.content.decode())
+            records.extend(result["Data"])
+            if len(result["Data"]) < pageSize or ("Total" in result and len(records) >= result["Total"]):
+                return records
+            page += 1
+
+    async def getReportList(self) -> List[DataExport]:
+        await self.cx_object.request("GET", "{}/Reporting/DataExport".format(self.url)) # navigate to the data exports page to grab cookies
+        data_export_list = [DataExport(report) for report in await self.readExportList()]
+
+        await self.cx_object.refreshSession() # Refresh our session
+        return data_export_list
+
+    #Return the item found by ID and its index in the list or None
+    def findReportByID(self, exportID: int, includeIndex: bool = False) -> Tuple[DataExport, Union[int, None]]:
+        idx = self.catalog.indexOf(exportID)
+        item = None if idx is None else self.report_list[idx]
+        if includeIndex:
+            return item, idx
+        return item
+
+    def update(self, export: DataExport):
+        self.catalog.add(export)
+
+    #runs export but does not download it, making it have fresh data to be pulled by downloadExport()
+    async def runExport(self, export: DataExport) -> None:
+        if self.cx_object.logoutTime > time.time():
+            r = await self.cx_object.request("GET", "{}/Reporting/RunExport_Window?guid={}&_/undefined&_={}".format(self.url, export.DynamicViewGUID, time.time() * 1000))
+            rvt = extractVerificationToken(r.content)
+
+            # Generate the report
+            r = await self.cx_object.request("POST", "{}/Reporting/RunExport_Window".format(self.url),
+                                    data={"__RequestVerificationToken": rvt,
+                                          "DynamicViewGUID": export.DynamicViewGUID,
+                                          "DataExportID": ""}
+                                )
+            if r.is_success:
+                export.requestedRun = int(time.time())
+                self.update(export)
+
+        await self.cx_object.refreshSession()
+
+    #Streams the export body, compressing it chunk by chunk to savePath when given, otherwise returns the raw bytes
+    #compression and writes run on a worker thread so the event loop keeps serving the other downloads
+    async def downloadExport(self, export: DataExport, savePath: str = None, chunkSize: int = DOWNLOAD_CHUNK_SIZE) -> Union[str, bytes]:
+        url = "{}/Reporting/DownloadExport?dataExportID={}&_".format(self.url, export.DataExportID)
+        async with self.cx_object.stream("GET", url) as response:
+            if not response.is_success:
+                raise Exception("An error occured and the file was unable to be downloaded - Status Code: {}".format(response.status_code))
+
+            if savePath:
+                fileName = exportFileName(savePath, export)
+                compressor = bz2.BZ2Compressor()
+                with open(fileName, "wb") as f:
+                    async for chunk in response.aiter_bytes(chunkSize):
+                        await asyncio.to_thread(lambda: f.write(compressor.compress(chunk)))
+                    await asyncio.to_thread(lambda: f.write(compressor.flush()))
+                result = fileName
+            else:
+                result = await response.aread()
+
+        await self.cx_object.refreshSession() # Refresh session
+        return result
+
+    async def get_report(self, Report: DataExport) -> DataFrame:
+        return read_csv(BytesIO(await self.downloadExport(Report)), dtype=object)
+
+    #Runs every export with at most maxConcurrency requests in flight on this event loop, polls the export list and
+    #downloads each export as soon as its LastExportDate moves past requestedRun. Returns DataExportID -> file path or exception
+    async def runAndDownloadExports(self, exports: List[DataExport], savePath: str, maxConcurrency: int = 4, pollInterval: int = 15, timeout: int = 3600) -> Dict[int, Union[str, Exception]]:
+        semaphore = asyncio.Semaphore(maxConcurrency)
+        results = {}
+        pending = {}
+        downloads = {}
+
+        async def limited(coro):
+            async with semaphore:
+                return await coro
+
+        for export in exports:
+            export.requestedRun = 0 # so a stale value from an earlier run cannot be mistaken for this one
+        runs = await asyncio.gather(*(limited(self.runExport(export)) for export in exports), return_exceptions=True)
+        for export, outcome in zip(exports, runs):
+            if isinstance(outcome, Exception):
+                results[export.DataExportID] = outcome
+            elif not export.requestedRun:
+                results[export.DataExportID] = Exception("CX did not accept the run request for {}".format(export))
+            else:
+                pending[export.DataExportID] = export
+
+        deadline = time.time() + timeout
+        while pending:
+            for record in await self.readExportList():
+                export = pending.get(record.get("DataExportID"))
+                if export is not None and exportTimestamp(record.get("LastExportDate")) > export.requestedRun:
+                    export.LastExportDate = record.get("LastExportDate")
+                    downloads[export.DataExportID] = asyncio.ensure_future(limited(self.downloadExport(pending.pop(export.DataExportID), savePath)))
+            if not pending:
+                break
+            if time.time() + pollInterval > deadline:
+                for exportID, export in pending.items():
+                    results[exportID] = TimeoutError("{} was not regenerated within {} seconds".format(export, timeout))
+                break
+            await self.cx_object.refreshSession() # keep the session alive while we wait
+            await asyncio.sleep(pollInterval)
+
+        for exportID, task in downloads.items():
+            try:
+                results[exportID] = await task
+            except Exception as e:
+                results[exportID] = e
+        return results
@@ -1,14 +1,41 @@
-import os, time, bz2, re, json
-from typing import Tuple, Type, Union
+import os, time, bz2, re, json, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple, Type, Union
 
-from etlcore.CX.CX import CX
-from bs4 import BeautifulSoup
-from pandas import read_csv
-from io import StringIO
+from etlcore.CX.CX import CX, extractVerificationToken
+from etlcore.DataUtils.TypedReader import read_typed_csv
+from pandas import DataFrame, read_csv
+from io import BytesIO, StringIO
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024 # 1 MiB per read when streaming exports
+EXPORT_LIST_PAGE_SIZE = 200
+
+#Where a downloaded export is saved, the DataExportID keeps two exports of the same DynamicView (same Slug) that
+#finish together from writing into one file
+def exportFileName(savePath: str, export) -> str:
+    return os.path.join(os.path.abspath(savePath), "{}-{}-{}.csv.bz2".format(int(time.time()), export.Slug, export.DataExportID))
+
+#CX serializes dates either as ASP.NET "/Date(1700000000000)/" strings or ISO strings, returns epoch seconds (0 when unknown)
+def exportTimestamp(value) -> float:
+    if value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        return value / 1000 if value > 1e11 else value # milliseconds vs seconds
+    match = re.search(r"/Date\((-?\d+)", value)
+    if match:
+        return int(match.group(1)) / 1000
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return 0
 
 
 class DataExport:
     """This class represents a single data export available to the user"""
+    __slots__ = ("DataExportID", "DynamicViewName", "Name", "RunByName", "DynamicViewGUID", "DynamicViewID",
+                 "RunBy", "JobID", "Downloadable", "LastExportDate", "Slug", "requestedRun")
+
     def __init__(self, record: dict) -> None:
         self.DataExportID = record.get("DataExportID", None)
         self.DynamicViewName = record.get("DynamicViewName", None)
@@ -20,26 +47,125 @@ class DataExport:
         self.JobID = record.get("JobID", None)
         self.Downloadable = record.get("Downloadable", None)
         self.LastExportDate = record.get("LastExportDate", None)
-        self.Slug = re.sub(r"[^0-9a-zA-Z]", "-", record.get("DynamicViewName", None))
+        self.Slug = re.sub(r"[^0-9a-zA-Z]", "-", record.get("DynamicViewName", None) or "")
         self.requestedRun = 0
 
+    #The CX fields this export was built from, used to persist the catalog
+    def toRecord(self) -> dict:
+        return {field: getattr(self, field) for field in DataExport.__slots__ if field not in ("Slug", "requestedRun")}
+
     def __repr__(self):
         return "DataExportID: {} - DynamicViewName: {} - RunByName: {}".format(self.DataExportID, self.DynamicViewName, self.RunByName)
 
+class ReportCatalog:
+    """Every data export available to the user, indexed by DataExportID, DynamicViewGUID and Slug"""
+    def __init__(self, exports: List[DataExport] = None, fetchedAt: float = None) -> None:
+        self.exports = []
+        self.fetchedAt = fetchedAt or time.time()
+        self._byID = {} # DataExportID -> index in exports
+        self._byGUID = {}
+        self._bySlug = {}
+        for export in exports or []:
+            self.add(export)
+
+    def __len__(self):
+        return len(self.exports)
+
+    #Adds the export or replaces the one with the same DataExportID, returns its index
+    def add(self, export: DataExport) -> int:
+        idx = self._byID.get(export.DataExportID)
+        if idx is None:
+            idx = len(self.exports)
+            self.exports.append(export)
+            self._byID[export.DataExportID] = idx
+        else:
+            self.exports[idx] = export
+        self._byGUID[export.DynamicViewGUID] = idx
+        self._bySlug[export.Slug] = idx
+        return idx
+
+    def indexOf(self, exportID: int) -> Optional[int]:
+        return self._byID.get(exportID)
+
+    def get(self, exportID: int) -> Optional[DataExport]:
+        idx = self._byID.get(exportID)
+        return None if idx is None else self.exports[idx]
+
+    def getByGUID(self, guid: str) -> Optional[DataExport]:
+        idx = self._byGUID.get(guid)
+        return None if idx is None else self.exports[idx]
+
+    def getBySlug(self, slug: str) -> Optional[DataExport]:
+        idx = self._bySlug.get(slug)
+        return None if idx is None else self.exports[idx]
+
+    def isExpired(self, ttl: int) -> bool:
+        return time.time() - self.fetchedAt > ttl
+
+    def save(self, cachePath: str) -> str:
+        tmpPath = "{}.tmp".format(cachePath)
+        with open(tmpPath, "w") as f:
+            json.dump({"fetchedAt": self.fetchedAt, "exports": [export.toRecord() for export in self.exports]}, f)
+        os.replace(tmpPath, cachePath) # never leave a half written cache behind
+        return cachePath
+
+    #Returns the cached catalog, or None if there is no cache file, it can't be read or it is older than ttl seconds
+    @classmethod
+    def load(cls, cachePath: str, ttl: int):
+        try:
+            with open(cachePath, "r") as f:
+                cached = json.load(f)
+            catalog = cls([DataExport(record) for record in cached["exports"]], cached["fetchedAt"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return None if catalog.isExpired(ttl) else catalog
+
 class CX_Utils:
     
+    #catalogCache/catalogTTL: optional path of a local report catalog cache and how many seconds it stays valid
+    #sessionStore: passed through to CX to reuse a stored session
     def __init__(self, URL: str, Username: str, Password: str, *args, **kwargs):
         self.url = URL
         self.username = Username
         self.password = Password
-        self.cx_object = CX(URL, Username, Password)
-        self.report_list = self.getReportList()
+        self.catalogCache = kwargs.get("catalogCache", None)
+        self.catalogTTL = kwargs.get("catalogTTL", 3600)
+        self.cx_object = CX(URL, Username, Password, sessionStore=kwargs.get("sessionStore", None))
+        self._listLock = threading.RLock() # report_list is updated from worker threads during batch runs
 
-    def getReportList(self):
-        response = self.cx_object.session.get("{}/Reporting/DataExport".format(self.url)) # navigate to the data exports page to grab cookies
-        response = self.cx_object.session.post("{}/Reporting/DataExportList_Read".format(self.url), data={"pageSize": 200}) # get the list of files
+        self.catalog = ReportCatalog.load(self.catalogCache, self.catalogTTL) if self.catalogCache else None
+        if self.catalog is None:
+            self.refreshCatalog()
+
+    @property
+    def report_list(self) -> List[DataExport]:
+        return self.catalog.exports
+
+    #Reloads every export from CX and rewrites the cache file when one is configured
+    def refreshCatalog(self) -> ReportCatalog:
+        catalog = ReportCatalog(self.getReportList())
+        with self._listLock:
+            self.catalog = catalog
+        if self.catalogCache:
+            catalog.save(self.catalogCache)
+        return catalog
 
-        availableReports = json.loads(response.content.decode())["Data"] # parse the list of data exports
+    #Returns the raw export records as CX reports them, used both for the report list and for polling LastExportDate
+    #pages through DataExportList_Read until a short page comes back, or CX's reported Total (when it sends one) has been read
+    def readExportList(self, pageSize: int = EXPORT_LIST_PAGE_SIZE) -> List[dict]:
+        records = []
+        page = 1
+        while True:
+            response = self.cx_object.request("POST", "{}/Reporting/DataExportList_Read".format(self.url), data={"page": page, "pageSize": pageSize}) # get the list of files
+            result = json.loads(response.content.decode()) # parse the list of data exports
+            records.extend(result["Data"])
+            if len(result["Data"]) < pageSize or ("Total" in result and len(records) >= result["Total"]):
+                return records
+            page += 1
+
+    def getReportList(self):
+        response = self.cx_object.request("GET", "{}/Reporting/DataExport".format(self.url)) # navigate to the data exports page to grab cookies
+        availableReports = self.readExportList()
 
         data_export_list = [] #create empty list
         for report in availableReports:
@@ -49,22 +175,23 @@ class CX_Utils:
         self.cx_object.refreshSession() # Refresh our session
         return data_export_list
 
-    #Return the first item found by ID and its index in the list or None
+    #Return the item found by ID and its index in the list or None
     def findReportByID(self, exportID: int, includeIndex: bool = False) -> Tuple[DataExport, Union[int, None]]:
-        for index, item in enumerate(self.report_list):
-            if item.DataExportID == exportID:
-                if includeIndex:
-                    return item, index
-                else:
-                    return item
-        return None # If we haven't found anything
+        idx = self.catalog.indexOf(exportID)
+        item = None if idx is None else self.report_list[idx]
+        if includeIndex:
+            return item, idx
+        return item
+
+    def findReportByGUID(self, guid: str) -> Optional[DataExport]:
+        return self.catalog.getByGUID(guid)
+
+    def findReportBySlug(self, slug: str) -> Optional[DataExport]:
+        return self.catalog.getBySlug(slug)
 
     def update(self, export: DataExport):
-        ex, idx = self.findReportByID(export.DataExportID, True) #idx = 35?
-        if ex is None: #identify what ex and idx are
-            self.report_list.append(export)
-        else:
-            self.report_list[idx] = ex
+        with self._listLock:
+            self.catalog.add(export)
     
     #runs export but does not download it, making it have fresh data to be pulled by downloadExport()
     def runExport(self, export: DataExport) -> None:
@@ -72,13 +199,12 @@ class CX_Utils:
             if self.report_list is None:
                 self.getReportList()
 
-            r = self.cx_object.session.get("{}/Reporting/RunExport_Window?guid={}&_/undefined&_={}".format(self.url, export.DynamicViewGUID, time.time() * 1000))
+            r = self.cx_object.request("GET", "{}/Reporting/RunExport_Window?guid={}&_/undefined&_={}".format(self.url, export.DynamicViewGUID, time.time() * 1000))
 
-            bs = BeautifulSoup(r.content, "lxml")
-            rvt = bs.find(attrs={"name": "__RequestVerificationToken"}).attrs["value"]
+            rvt = extractVerificationToken(r.content)
 
             # Generate the report
-            r = self.cx_object.session.post("{}/Reporting/RunExport_Window".format(self.url),
+            r = self.cx_object.request("POST", "{}/Reporting/RunExport_Window".format(self.url),
                                     data={"__RequestVerificationToken": rvt,
                                           "DynamicViewGUID": export.DynamicViewGUID,
                                           "DataExportID": ""}
@@ -89,13 +215,27 @@ class CX_Utils:
 
         self.cx_object.refreshSession()
 
-    def downloadExport(self, export: Type[DataExport], savePath: str = None) -> Union[str, bytes]:
-        response = self.cx_object.session.get("{}/Reporting/DownloadExport?dataExportID={}&_".format(self.url, export.DataExportID))
+    def downloadExport(self, export: Type[DataExport], savePath: str = None, stream: bool = False, chunkSize: int = DOWNLOAD_CHUNK_SIZE) -> Union[str, bytes]:
+        if stream and not savePath:
+            raise ValueError("A savePath is required to stream an export to disk, use get_report_chunks() to parse it without saving")
+
+        response = self.cx_object.request("GET", "{}/Reporting/DownloadExport?dataExportID={}&_".format(self.url, export.DataExportID), stream=stream)
+
+        if response.ok and stream: # Compress each chunk as it arrives so only one chunk is held in memory
+            fileName = exportFileName(savePath, export)
+            compressor = bz2.BZ2Compressor()
+            with response, open(fileName, "wb") as f:
+                for chunk in response.iter_content(chunk_size=chunkSize):
+                    f.write(compressor.compress(chunk))
+                f.write(compressor.flush())
+            self.cx_object.refreshSession() # Refresh session once the body has been consumed
+            return fileName
+
         if response.ok:
             self.cx_object.refreshSession() # Refresh session
 
         if response.ok and savePath: # Save our file and return the path
-            fileName = os.path.join(os.path.abspath(savePath), "{}-{}.csv.bz2".format(int(time.time()), export.Slug))
+            fileName = exportFileName(savePath, export)
             with open(fileName, "wb") as f:
                 content = bz2.compress(response.content)
                 f.write(content)
@@ -106,7 +246,75 @@ class CX_Utils:
 
         else:
             raise Exception("An error occured and the file was unable to be downloaded - Status Code: {}".format(response.status_code))
-        
-    def get_report(cx_util, Report: DataExport):
+
+    #Triggers every export with at most maxWorkers requests in flight, then polls the export list and downloads each
+    #export as soon as its LastExportDate moves past requestedRun. Returns DataExportID -> saved file path, or the exception for that export
+    def runAndDownloadExports(self, exports: List[DataExport], savePath: str, maxWorkers: int = 4, pollInterval: int = 15, timeout: int = 3600) -> Dict[int, Union[str, Exception]]:
+        results = {}
+        pending = {}
+        downloads = {}
+
+        with ThreadPoolExecutor(max_workers=maxWorkers) as pool:
+            for export in exports:
+                export.requestedRun = 0 # so a stale value from an earlier run cannot be mistaken for this one
+            runs = {pool.submit(self.runExport, export): export for export in exports}
+            for future in as_completed(runs):
+                export = runs[future]
+                if future.exception() is not None:
+                    results[export.DataExportID] = future.exception()
+                elif not export.requestedRun:
+                    results[export.DataExportID] = Exception("CX did not accept the run request for {}".format(export))
+                else:
+                    pending[export.DataExportID] = export
+
+            deadline = time.time() + timeout
+            while pending:
+                for record in self.readExportList():
+                    export = pending.get(record.get("DataExportID"))
+                    if export is not None and exportTimestamp(record.get("LastExportDate")) > export.requestedRun:
+                        export.LastExportDate = record.get("LastExportDate")
+                        downloads[pool.submit(self.downloadExport, export, savePath, True)] = pending.pop(export.DataExportID)
+                if not pending:
+                    break
+                if time.time() + pollInterval > deadline:
+                    for exportID, export in pending.items():
+                        results[exportID] = TimeoutError("{} was not regenerated within {} seconds".format(export, timeout))
+                    break
+                self.cx_object.refreshSession() # keep the session alive while we wait
+                time.sleep(pollInterval)
+
+            for future in as_completed(downloads):
+                export = downloads[future]
+                try:
+                    results[export.DataExportID] = future.result()
+                except Exception as e:
+                    results[export.DataExportID] = e
+
+        return results
+
+    #dtype_dict: optional sqlalchemy type map (DataUtils.get_table_dtypes) to parse the report typed and projected in one pass
+    def get_report(cx_util, Report: DataExport, dtype_dict: dict = None, use_pyarrow: bool = False):
+        if dtype_dict:
+            return read_typed_csv(BytesIO(cx_util.downloadExport(Report)), dtype_dict, use_pyarrow=use_pyarrow)
         return read_csv(StringIO(cx_util.downloadExport(Report).decode()), dtype=object)
+
+    #Returns an iterator of DataFrames with at most chunksize rows each, parsed straight from the byte stream
+    #if savePath is given the export is streamed to a compressed file first and parsed from there, which frees the connection sooner
+    def get_report_chunks(self, Report: DataExport, chunksize: int = 100000, savePath: str = None) -> Iterator[DataFrame]:
+        if savePath:
+            fileName = self.downloadExport(Report, savePath, stream=True)
+            with read_csv(fileName, dtype=object, compression="bz2", chunksize=chunksize) as reader:
+                yield from reader
+            return
+
+        response = self.cx_object.request("GET", "{}/Reporting/DownloadExport?dataExportID={}&_".format(self.url, Report.DataExportID), stream=True)
+        if not response.ok:
+            response.close()
+            raise Exception("An error occured and the file was unable to be downloaded - Status Code: {}".format(response.status_code))
+
+        with response:
+            response.raw.decode_content = True # let urllib3 undo any gzip transfer encoding while we read
+            with read_csv(response.raw, dtype=object, chunksize=chunksize) as reader:
+                yield from reader
+        self.cx_object.refreshSession()
       
\ No newline at end of file
@@ -1,47 +1,120 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Union
 import pandas as pd
-from sqlalchemy import create_engine, text
-from sqlalchemy.engine.base import Engine
+from sqlalchemy import inspect, text
+from sqlalchemy.types import Date, DateTime, Float, Time
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.engine.base import Connection, Engine
+
+from etlcore.DB.EngineRegistry import EngineRegistry
+from etlcore.DB.Loaders import ExecuteManyLoader, LoadResult, StagingLoader, ToSqlLoader, require_append
 
 class DB():
-    def __init__(self, con_str, org, auto_commit: bool = True):
+    #pool_options (pool_size, max_overflow, pool_timeout, pool_recycle, pool_pre_ping) are only used the first time
+    #an engine is created for con_str, after that every DB for the same database shares it
+    def __init__(self, con_str, org, auto_commit: bool = True, **pool_options):
         self.con_str = con_str
         self.org = org
+        self.auto_commit = auto_commit
+        self.pool_options = pool_options
         self.engine = self._create_db_connection(auto_commit)
+        self.last_load = None #LoadResult of the most recent load_to_staging call
+        self.last_partitions = [] #per partition LoadResults of the most recent load_to_staging_parallel call
 
     def _create_db_connection(self, auto_commit: bool = True) -> Engine:
         try:
-            if auto_commit:
-                engine = create_engine(self.con_str, fast_executemany=True, execution_options={"isolation_level": "AUTOCOMMIT"})
-            else:
-                engine = create_engine(self.con_str, fast_executemany=True)
-            con = engine.connect()
+            engine = EngineRegistry.get_engine(self.con_str, auto_commit, **self.pool_options)
+            with EngineRegistry.connect(engine):
+                pass # check out a connection once so a bad connection string fails here
             print("successfully connected to the database")
-            return con
+            return engine
         except Exception as e:
             return f"unable to connect to db {str(e)}"
 
     def change_db_connection(self, con_str: str) -> bool:
-        self.engine = create_engine(con_str, fast_executemany=True, execution_options={"isolation_level": "AUTOCOMMIT"})
+        self.con_str = con_str
+        self.engine = EngineRegistry.get_engine(con_str, self.auto_commit, **self.pool_options)
         return True
 
-    def load_to_staging(self, df: pd.DataFrame, schema: str, table_name: str, dtype_dict: dict, chunksize: int = 1000) -> bool:
+    #checks a pooled connection out for one operation, commits it if a transaction was started and returns it to the pool
+    @contextmanager
+    def connection(self) -> Iterator[Connection]:
+        with EngineRegistry.connect(self.engine) as con:
+            yield con
+
+    def pool_stats(self) -> dict:
+        return EngineRegistry.pool_stats(self.con_str)
+
+    #loader picks the strategy from etlcore.DB.Loaders, by default the original df.to_sql replace
+    #the timing of the load is kept in self.last_load
+    def load_to_staging(self, df: pd.DataFrame, schema: str, table_name: str, dtype_dict: dict, chunksize: int = 1000, loader: StagingLoader = None) -> bool:
         try:
-            #chunksize = 2100 // len(df.columns) #calculating chunksize
-            df.to_sql(name = f"RAW_{table_name}", 
-                      dtype= dtype_dict, 
-                      con = self.engine, 
-                      schema = schema, 
-                      if_exists = "replace", 
-                      index=False, 
-                      chunksize=chunksize)
+            loader = loader or ToSqlLoader(chunksize)
+            with self.connection() as con:
+                self.last_load = loader.load(con, df, schema, f"RAW_{table_name}", dtype_dict)
+            print(self.last_load)
             return True
         except Exception as e:
             return f"insert failed {str(e)}"
 
+    #loads data into RAW_{table_name} over up to max_workers pooled connections at once
+    #data is a DataFrame, split into partitions of partition_rows, or an iterator of DataFrame chunks that is consumed as it loads
+    #the staging table is readied once from the first partition with loader.prepare (created, or emptied by TruncateReuseLoader),
+    #then every partition is appended with loader.append,
+    #so loader has to support appending (ValueError otherwise). per partition timings end up in self.last_partitions and the total in self.last_load
+    def load_to_staging_parallel(self, data: Union[pd.DataFrame, Iterable[pd.DataFrame]], schema: str, table_name: str, dtype_dict: dict,
+                                 max_workers: int = 4, partition_rows: int = 100000, loader: StagingLoader = None) -> bool:
+        loader = require_append(loader or ExecuteManyLoader(create_table=False))
+        staging_table = f"RAW_{table_name}"
+        if isinstance(data, pd.DataFrame):
+            partitions = (data.iloc[start:start + partition_rows] for start in range(0, max(len(data), 1), partition_rows))
+        else:
+            partitions = iter(data)
+
+        def load_partition(partition: pd.DataFrame) -> LoadResult:
+            with self.connection() as con:
+                return loader.append(con, partition, schema, staging_table, dtype_dict)
+
+        start = time.perf_counter()
+        results = {}
+        failures = {}
+        try:
+            first = next(partitions, None)
+            if first is None:
+                return "insert failed: no data to load"
+            with self.connection() as con:
+                loader.prepare(con, first, schema, staging_table, dtype_dict)
+
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                in_flight = {}
+                for index, partition in enumerate(_chain(first, partitions)):
+                    if len(in_flight) >= max_workers: # hold back so only max_workers partitions are in memory at once
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        _collect(done, in_flight, results, failures)
+                    if failures:
+                        break # stop feeding partitions once one has failed
+                    in_flight[pool.submit(load_partition, partition)] = index
+                _collect(list(in_flight), in_flight, results, failures)
+        except Exception as e:
+            return f"insert failed {str(e)}"
+
+        self.last_partitions = [results[i] for i in sorted(results)]
+        if failures:
+            details = "; ".join(f"partition {i}: {str(e)}" for i, e in sorted(failures.items()))
+            return f"insert failed for {len(failures)} partition(s) of {staging_table}, {len(results)} loaded: {details}"
+
+        self.last_load = LoadResult(f"parallel {loader.name} x{max_workers}", f"{schema}.{staging_table}",
+                                    sum(r.rows for r in self.last_partitions), time.perf_counter() - start)
+        print(self.last_load)
+        return True
+
     #dynamic kill/fill of table
     def kill_fill(self, stage_db: str, dest_schema: str, table_name: str) -> bool:
         try:
-            self.engine.execute(text(f"EXECUTE dbo.spETL_KillFillDSQL @table = '{table_name}', @org = '{self.org}', @stage_db = '{stage_db}', @dest_schema='{dest_schema}'"))
+            with self.connection() as con:
+                con.execute(text(f"EXECUTE dbo.spETL_KillFillDSQL @table = '{table_name}', @org = '{self.org}', @stage_db = '{stage_db}', @dest_schema='{dest_schema}'"))
             return True
         except Exception as e:
             return f"kill/fill of table failed: {str(e)}"
@@ -49,7 +122,8 @@ class DB():
     #this should be used for ETL flows that use @q logging as a result
     def run_proc(self, db: str, schema: str, stored_procedure: str) -> bool: 
         try:
-            result = self.engine.execute(text(f"EXECUTE {db}.{schema}.{stored_procedure}")).fetchall()
+            with self.connection() as con:
+                result = con.execute(text(f"EXECUTE {db}.{schema}.{stored_procedure}")).fetchall()
             for q in result[0]:
                 if q == 1:
                     return f"Query{list(result[0]).index(q) + 1} has failed"
@@ -60,7 +134,8 @@ class DB():
     #runs stored procedure and returns results
     def run_proc_with_results(self, db: str, schema: str, stored_procedure: str):
         try:
-            result = self.engine.execute(text(f"EXECUTE {db}.{schema}.{stored_procedure}")).fetchall()
+            with self.connection() as con:
+                result = con.execute(text(f"EXECUTE {db}.{schema}.{stored_procedure}")).fetchall()
             return result
         except Exception as e:
             return f"stored procedure run {stored_procedure} failed! error string: {str(e)}"
@@ -68,9 +143,137 @@ class DB():
     #runs stored procedure with parameter and returns results
     def run_proc_with_param(self, db: str, schema: str, stored_procedure: str, param: str):
         try:
-            result = self.engine.execute(text(f"EXECUTE {db}.{schema}.{stored_procedure} '{param}'")).fetchall()
+            with self.connection() as con:
+                result = con.execute(text(f"EXECUTE {db}.{schema}.{stored_procedure} :param"), {"param": param}).fetchall()
             return result #
         except Exception as e:
             return f"stored procedure run {stored_procedure} failed! error string: {str(e)}"
-    def upsert(self):
-        raise NotImplementedError
\ No newline at end of file
+
+    #EXECUTE statement with every parameter bound by name (@name = :name) so the plan can be reused
+    def _proc_statement(self, db: str, schema: str, stored_procedure: str, params: dict = None) -> TextClause:
+        args = ", ".join(f"@{name} = :{name}" for name in params) if params else ""
+        return text(f"EXECUTE {db}.{schema}.{stored_procedure} {args}".rstrip())
+
+    #runs stored procedure and yields its rows in lists of at most batch_size, fetched with fetchmany on a streaming cursor
+    #unlike run_proc_with_results errors are raised, since a generator has nothing to return them in
+    def stream_proc_results(self, db: str, schema: str, stored_procedure: str, params: dict = None, batch_size: int = 10000) -> Iterator[list]:
+        with self.connection() as con: # the connection stays checked out until the generator is exhausted or closed
+            result = con.execute(self._proc_statement(db, schema, stored_procedure, params),
+                                 params or {},
+                                 execution_options={"stream_results": True, "max_row_buffer": batch_size})
+            try:
+                while True:
+                    rows = result.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                result.close()
+
+    #same as stream_proc_results but yields DataFrames, dtypes is an optional {column: pandas dtype} applied to each chunk
+    def stream_proc_dataframes(self, db: str, schema: str, stored_procedure: str, params: dict = None, batch_size: int = 10000, dtypes: dict = None) -> Iterator[pd.DataFrame]:
+        for rows in self.stream_proc_results(db, schema, stored_procedure, params, batch_size):
+            df = pd.DataFrame.from_records(rows, columns=list(rows[0]._fields))
+            yield df.astype(dtypes) if dtypes else df
+
+    #highest value of column in schema.table_name, None for an empty table
+    def get_high_watermark(self, schema: str, table_name: str, column: str):
+        try:
+            with self.connection() as con:
+                return con.execute(text(f"SELECT MAX([{column}]) FROM [{schema}].[{table_name}]")).scalar()
+        except Exception as e:
+            return f"unable to read high watermark of {schema}.{table_name}.{column}: {str(e)}"
+
+    #set-based alternative to kill_fill: MERGE {stage_db}.{stage_schema}.RAW_{table_name} into {dest_schema}.{table_name} on key_columns
+    #rows are compared with a SHA2_256 hash of every non-key column, so matched rows whose values did not change are never written
+    #with watermark_column only staging rows newer than the destination's current maximum are merged
+    #returns {"inserted", "updated", "unchanged", "watermark"} where watermark is the destination maximum after the merge
+    def upsert(self, stage_db: str, dest_schema: str, table_name: str, key_columns: list, stage_schema: str = None, watermark_column: str = None) -> dict:
+        try:
+            with self.connection() as con:
+                columns = [c for c in inspect(con).get_columns(table_name, schema=dest_schema)
+                           if not c.get("identity") and not c.get("computed")] # the database fills these itself
+                source = f"[{stage_db}].[{stage_schema or dest_schema}].[RAW_{table_name}]"
+                target = f"[{dest_schema}].[{table_name}]"
+                params = {}
+                source_filter = ""
+                if watermark_column:
+                    params["watermark"] = con.execute(text(f"SELECT MAX([{watermark_column}]) FROM {target}")).scalar()
+                    if params["watermark"] is not None:
+                        source_filter = f"WHERE [{watermark_column}] > :watermark"
+
+                counts = con.execute(text(_merge_statement(source, target, columns, key_columns, source_filter)), params).one()
+                inserted, updated, source_rows = (int(count or 0) for count in counts)
+                result = {"inserted": inserted, "updated": updated, "unchanged": source_rows - inserted - updated, "watermark": None}
+                if watermark_column:
+                    result["watermark"] = con.execute(text(f"SELECT MAX([{watermark_column}]) FROM {target}")).scalar()
+            print(f"upsert of {target}: {result}")
+            return result
+        except Exception as e:
+            return f"upsert of table failed: {str(e)}"
+
+
+def _chain(first: pd.DataFrame, rest: Iterator[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    yield first
+    yield from rest
+
+
+#moves finished partition futures out of in_flight into results or failures
+def _collect(done, in_flight: dict, results: dict, failures: dict) -> None:
+    for future in done:
+        index = in_flight.pop(future)
+        try:
+            results[index] = future.result()
+        except Exception as e:
+            failures[index] = e
+
+
+#T-SQL expression that renders a column as text for hashing, keeping full precision for dates and floats
+#and turning NULL into CHAR(0) so NULL and '' hash differently
+def _hash_input(alias: str, column: dict) -> str:
+    name = f"{alias}.[{column['name']}]"
+    match column["type"]:
+        case DateTime() | Date() | Time():
+            expression = f"CONVERT(NVARCHAR(40), {name}, 121)"
+        case Float():
+            expression = f"CONVERT(NVARCHAR(40), {name}, 2)"
+        case _:
+            expression = f"CONVERT(NVARCHAR(MAX), {name})"
+    return f"ISNULL({expression}, CHAR(0))"
+
+
+def _row_hash(alias: str, columns: list) -> str:
+    if len(columns) == 1: # CONCAT_WS needs at least two arguments
+        return f"HASHBYTES('SHA2_256', {_hash_input(alias, columns[0])})"
+    return f"HASHBYTES('SHA2_256', CONCAT_WS(CHAR(31), {', '.join(_hash_input(alias, c) for c in columns)}))"
+
+
+def _merge_statement(source: str, target: str, columns: list, key_columns: list, source_filter: str = "") -> str:
+    names = [c["name"] for c in columns]
+    missing = [k for k in key_columns if k not in names]
+    if missing:
+        raise ValueError(f"key columns {missing} are not columns of {target}")
+    compare = [c for c in columns if c["name"] not in key_columns]
+
+    column_list = ", ".join(f"[{n}]" for n in names)
+    on = " AND ".join(f"t.[{k}] = s.[{k}]" for k in key_columns)
+    when_matched = ""
+    if compare:
+        update_set = ", ".join(f"t.[{c['name']}] = s.[{c['name']}]" for c in compare)
+        when_matched = f"WHEN MATCHED AND {_row_hash('t', compare)} <> {_row_hash('s', compare)} THEN UPDATE SET {update_set}"
+
+    return f"""
+SET NOCOUNT ON;
+DECLARE @changes TABLE ([action] NVARCHAR(10));
+MERGE {target} WITH (HOLDLOCK) AS t
+USING (SELECT {column_list} FROM {source} {source_filter}) AS s
+ON {on}
+{when_matched}
+WHEN NOT MATCHED BY TARGET THEN INSERT ({column_list}) VALUES ({", ".join(f"s.[{n}]" for n in names)})
+OUTPUT $action INTO @changes;
+SELECT
+    SUM(CASE WHEN [action] = 'INSERT' THEN 1 ELSE 0 END),
+    SUM(CASE WHEN [action] = 'UPDATE' THEN 1 ELSE 0 END),
+    (SELECT COUNT(*) FROM {source} {source_filter})
+FROM @changes;
+"""
@@ -0,0 +1,140 @@
+import time, threading
+from contextlib import contextmanager
+from typing import Iterator
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.engine.base import Connection, Engine
+
+
+#Counters for one pooled engine, filled in by pool events and by EngineRegistry.connect()
+class PoolStats():
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0 # new DBAPI connections (logins) opened by the pool
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.wait_seconds = 0.0 # total time spent waiting for engine.connect() to hand over a connection
+        self.max_wait_seconds = 0.0
+        self.max_overflow_seen = 0
+
+    def record_wait(self, seconds: float, overflow: int) -> None:
+        with self._lock:
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+            self.max_overflow_seen = max(self.max_overflow_seen, overflow)
+
+    def increment(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "invalidations": self.invalidations,
+                "wait_seconds": self.wait_seconds,
+                "avg_wait_seconds": self.wait_seconds / self.checkouts if self.checkouts else 0.0,
+                "max_wait_seconds": self.max_wait_seconds,
+                "max_overflow_seen": self.max_overflow_seen,
+            }
+
+
+#Process-wide cache of Engines keyed by connection string, so every DB object that points at the same database
+#shares one connection pool instead of logging in again
+class EngineRegistry():
+    _engines = {} # (connection string, auto_commit) -> Engine
+    _stats = {} # Engine -> PoolStats
+    _lock = threading.Lock()
+
+    pool_size = 5
+    max_overflow = 10
+    pool_timeout = 30
+    pool_recycle = 1800 # Azure SQL drops idle connections after 30 minutes
+    pool_pre_ping = True
+
+    @classmethod
+    def get_engine(cls, con_str: str, auto_commit: bool = True, **pool_options) -> Engine:
+        key = (con_str, auto_commit)
+        with cls._lock:
+            engine = cls._engines.get(key)
+            if engine is None:
+                engine = cls._create_engine(con_str, auto_commit, **pool_options)
+                cls._stats[engine] = cls._track(engine)
+                cls._engines[key] = engine
+            return engine
+
+    @classmethod
+    def _create_engine(cls, con_str: str, auto_commit: bool, **pool_options) -> Engine:
+        url = make_url(con_str)
+        kwargs = {"pool_pre_ping": pool_options.get("pool_pre_ping", cls.pool_pre_ping),
+                  "pool_recycle": pool_options.get("pool_recycle", cls.pool_recycle)}
+        if url.get_backend_name() != "sqlite": # sqlite's default pools do not take sizing arguments
+            kwargs.update({"pool_size": pool_options.get("pool_size", cls.pool_size),
+                           "max_overflow": pool_options.get("max_overflow", cls.max_overflow),
+                           "pool_timeout": pool_options.get("pool_timeout", cls.pool_timeout)})
+        if url.get_driver_name() == "pyodbc":
+            kwargs["fast_executemany"] = True
+        if auto_commit:
+            kwargs["execution_options"] = {"isolation_level": "AUTOCOMMIT"}
+        return create_engine(con_str, **kwargs)
+
+    @classmethod
+    def _track(cls, engine: Engine) -> PoolStats:
+        stats = PoolStats()
+        event.listen(engine, "connect", lambda *args: stats.increment("connects"))
+        event.listen(engine, "checkout", lambda *args: stats.increment("checkouts"))
+        event.listen(engine, "checkin", lambda *args: stats.increment("checkins"))
+        event.listen(engine, "invalidate", lambda *args: stats.increment("invalidations"))
+        return stats
+
+    #Checks a connection out of engine's pool for the length of the with block, timing how long the checkout waited
+    @classmethod
+    @contextmanager
+    def connect(cls, engine: Engine) -> Iterator[Connection]:
+        stats = cls._stats.get(engine)
+        start = time.perf_counter()
+        con = engine.connect()
+        if stats is not None:
+            stats.record_wait(time.perf_counter() - start, _overflow(engine))
+        try:
+            yield con
+            if con.in_transaction():
+                con.commit()
+        finally:
+            con.close()
+
+    #{connection string: counters and current pool state}, for one connection string or every registered engine
+    @classmethod
+    def pool_stats(cls, con_str: str = None) -> dict:
+        result = {}
+        with cls._lock:
+            for (key_con_str, auto_commit), engine in cls._engines.items():
+                if con_str is not None and key_con_str != con_str:
+                    continue
+                stats = cls._stats[engine].as_dict()
+                pool = engine.pool
+                stats.update({
+                    "auto_commit": auto_commit,
+                    "pool_size": pool.size() if hasattr(pool, "size") else None,
+                    "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+                    "overflow": _overflow(engine),
+                })
+                name = engine.url.render_as_string(hide_password=True)
+                result[f"{name} (autocommit)" if auto_commit else name] = stats
+        return result
+
+    #closes every pooled connection and forgets the engines, e.g. at the end of a flow or after a fork
+    @classmethod
+    def dispose_all(cls) -> None:
+        with cls._lock:
+            for engine in cls._engines.values():
+                engine.dispose()
+            cls._engines.clear()
+            cls._stats.clear()
+
+
+def _overflow(engine: Engine) -> int:
+    return max(engine.pool.overflow(), 0) if hasattr(engine.pool, "overflow") else 0
@@ -0,0 +1,336 @@
+import os, csv, time, uuid
+import pandas as pd
+from sqlalchemy import inspect, text
+from sqlalchemy.engine.base import Connection
+from sqlalchemy.dialects.mssql import (
+    BIGINT,
+    DATETIME2,
+    SMALLDATETIME,
+    UNIQUEIDENTIFIER,
+)
+from sqlalchemy.types import (
+    CHAR,
+    DECIMAL,
+    BigInteger,
+    Boolean,
+    Date,
+    DateTime,
+    Float,
+    Integer,
+    String,
+    SmallInteger
+)
+
+SQL_SERVER_PARAM_LIMIT = 2100 # max bound parameters per statement
+SQL_SERVER_VALUES_LIMIT = 1000 # max rows in one INSERT ... VALUES list
+
+
+class LoadResult():
+    def __init__(self, strategy: str, table_name: str, rows: int, seconds: float):
+        self.strategy = strategy
+        self.table_name = table_name
+        self.rows = rows
+        self.seconds = seconds
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else float(self.rows)
+
+    def __repr__(self):
+        return f"{self.strategy} loaded {self.rows} rows into {self.table_name} in {self.seconds:.2f}s ({self.rows_per_second:,.0f} rows/s)"
+
+
+#Base class for the ways load_to_staging can move a DataFrame into a staging table
+#subclasses implement _load() and load() times it, load() may create, replace or empty the table
+#subclasses that can add rows to an existing table without touching what is already there also implement _append()
+#a chunked or partitioned load calls prepare() once and then append() for every piece
+class StagingLoader():
+    name = "base"
+
+    def load(self, con: Connection, df: pd.DataFrame, schema: str, table_name: str, dtype_dict: dict) -> LoadResult:
+        start = time.perf_counter()
+        self._load(con, df, schema, table_name, dtype_dict)
+        return LoadResult(self.name, f"{schema}.{table_name}", len(df), time.perf_counter() - start)
+
+    #the only call used when several chunks or partitions go into one table
+    def append(self, con: Connection, df: pd.DataFrame, schema: str, table_name: str, dtype_dict: dict) -> LoadResult:
+        start = time.perf_counter()
+        self._append(con, df, schema, table_name, dtype_dict)
+        return LoadResult(self.name, f"{schema}.{table_name}", len(df), time.perf_counter() - start)
+
+    #readies an empty table shaped like df for append(), by default by (re)creating it
+    def prepare(self, con: Connection, df: pd.DataFrame, schema: str, table_name: str, dtype_dict: dict) -> None:
+        self._create_table(con, df, schema, table_name, dtype_dict)
+        self._commit(con)
+
+    @property
+    def can_append(self) -> bool:
+        return type(self)._append is not StagingLoader._append
+
+    def _load(self, con: Connection, df: pd.DataFrame, schema: str, table_name: str, dtype_dict: dict) -> None:
+        raise NotImplementedError
+
+    def _append(self, con: Connection, df: pd.DataFrame, schema: str, table_name: str, dtype_dict: dict) -> None:
+        raise NotImplementedError
+
+    #creates (or recreates) an empty table shaped like df
+    def _create_table(self, con: Connection, df: pd.DataFrame, schema: str, table_name: str, dtype_dict: dict) -> None:
+        df.head(0).to_sql(name=table_name, dtype=dtype_dict, con=con, schema=schema, if_exists="replace", index=False)
+
+    def _table_exists(self, con: Connection, schema: str, table_name: str) -> bool:
+        return inspect(con).has_table(table_name, schema=schema)
+
+    def _commit(self, con: Connection) -> None:
+        if con.in_transaction():
+            con.commit()
+
+
+#The original behavior: drop and recreate the table with df.to_sql in fixed size batches
+class ToSqlLoader(StagingLoader):
+    name = "to_sql"
+
+    def __init__(self, chunksize: int = 1000):
+        self.chunksize = chunksize
+
+    def _load(self, con, df, schema, table_name, dtype_dict):
+        df.to_sql(name=table_name, dtype=dtype_dict, con=con, schema=schema, if_exists="replace", index=False, chunksize=self.chunksize)
+
+    def _append(self, con, df, schema, table_name, dtype_dict):
+        df.to_sql(name=table_name, dtype=dtype_dict, con=con, schema=schema, if_exists="append", index=False, chunksize=self.chunksize)
+        self._commit(con)
+
+
+#Multi-row INSERT ... VALUES batches sized so each statement stays under the driver's parameter limit
+class AdaptiveChunkLoader(StagingLoader):
+    name = "adaptive_chunk"
+
+    def __init__(self, param_limit: int = SQL_SERVER_PARAM_LIMIT, max_rows: int = SQL_SERVER_VALUES_LIMIT):
+        self.param_limit = param_limit
+        self.max_rows = max_rows
+
+    def chunksize(self, column_count: int) -> int:
+        return max(1, min(self.max_rows, (self.param_limit - 1) // max(column_count, 1)))
+
+    def _load(self, con, df, schema, table_name, dtype_dict):
+        df.to_sql(name=table_name, dtype=dtype_dict, con=con, schema=schema, if_exists="replace", index=False,
+                  chunksize=self.chunksize(len(df.columns)), method="multi")
+
+    def _append(self, con, df, schema, table_name, dtype_dict):
+        df.to_sql(name=table_name, dtype=dtype_dict, con=con, schema=schema, if_exists="append", index=False,
+                  chunksize=self.chunksize(len(df.columns)), method="multi")
+        self._commit(con)
+
+
+#Creates the table once and sends the rows with cursor.executemany, on pyodbc it turns on fast_executemany and
+#calls setinputsizes from dtype_dict so the driver does not have to guess a type and width per column
+class ExecuteManyLoader(StagingLoader):
+    name = "executemany"
+
+    def __init__(self, batch_size: int = 50000, create_table: bool = True):
+        self.batch_size = batch_size
+        self.create_table = create_table
+
+    def _load(self, con, df, schema, table_name, dtype_dict):
+        if self.create_table:
+            self._create_table(con, df, schema, table_name, dtype_dict)
+        self.insert(con, df, schema, table_name, dtype_dict)
+
+    def _append(self, con, df, schema, table_name, dtype_dict):
+        self.insert(con, df, schema, table_name, dtype_dict)
+
+    #appends df to an existing table
+    def insert(self, con: Connection, df: pd.DataFrame, schema: str, table_name: str, dtype_dict: dict) -> None:
+        quote = con.dialect.identifier_preparer.quote
+        target = f"{quote(schema)}.{quote(table_name)}" if schema else quote(table_name)
+        columns = ", ".join(quote(c) for c in df.columns)
+        statement = f"INSERT INTO {target} ({columns}) VALUES ({', '.join(_placeholders(con.dialect.paramstyle, len(df.columns)))})"
+
+        self._commit(con) # make sure the table created above is visible to the raw cursor
+        dbapi_con = con.connection.dbapi_connection
+        restore = _disable_autocommit(dbapi_con) # under AUTOCOMMIT every row would otherwise be its own transaction
+        cursor = dbapi_con.cursor()
+        try:
+            if con.dialect.driver == "pyodbc":
+                cursor.fast_executemany = True
+                cursor.setinputsizes(pyodbc_input_sizes(df.columns, dtype_dict))
+            for start in range(0, len(df), self.batch_size):
+                cursor.executemany(statement, _python_rows(df.iloc[start:start + self.batch_size]))
+            dbapi_con.commit()
+        except Exception:
+            dbapi_con.rollback()
+            raise
+        finally:
+            cursor.close()
+            restore()
+
+
+#Keeps an existing staging table (and its permissions, indexes and statistics) and empties it instead of dropping it
+#the rows are then appended with inner, which defaults to ExecuteManyLoader
+class TruncateReuseLoader(StagingLoader):
+    name = "truncate_reuse"
+
+    def __init__(self, inner: ExecuteManyLoader = None):
+        self.inner = inner or ExecuteManyLoader()
+
+    def _load(self, con, df, schema, table_name, dtype_dict):
+        self.prepare(con, df, schema, table_name, dtype_dict)
+        self.inner.insert(con, df, schema, table_name, dtype_dict)
+
+    #empties the table when it exists and only creates it when it doesn't
+    def prepare(self, con, df, schema, table_name, dtype_dict):
+        if not self._table_exists(con, schema, table_name):
+            self._create_table(con, df, schema, table_name, dtype_dict)
+        else:
+            quote = con.dialect.identifier_preparer.quote
+            target = f"{quote(schema)}.{quote(table_name)}" if schema else quote(table_name)
+            keyword = "DELETE FROM" if con.dialect.name == "sqlite" else "TRUNCATE TABLE" # sqlite has no TRUNCATE
+            con.execute(text(f"{keyword} {target}"))
+        self._commit(con)
+
+    def _append(self, con, df, schema, table_name, dtype_dict):
+        self.inner.insert(con, df, schema, table_name, dtype_dict)
+
+
+#SQL Server only: writes df to a CSV file the server can read and loads it with BULK INSERT
+#local_dir is where this process writes the file, server_dir is the same folder as the SQL Server sees it
+class BulkFileLoader(StagingLoader):
+    name = "bulk_file"
+
+    def __init__(self, local_dir: str, server_dir: str = None, batch_size: int = 100000, keep_file: bool = False):
+        self.local_dir = local_dir
+        self.server_dir = server_dir or local_dir
+        self.batch_size = batch_size
+        self.keep_file = keep_file
+
+    def _load(self, con, df, schema, table_name, dtype_dict):
+        if con.dialect.name != "mssql":
+            raise NotImplementedError(f"BULK INSERT is not available for {con.dialect.name}")
+        self._create_table(con, df, schema, table_name, dtype_dict)
+        self._append(con, df, schema, table_name, dtype_dict)
+
+    def _append(self, con, df, schema, table_name, dtype_dict):
+        if con.dialect.name != "mssql":
+            raise NotImplementedError(f"BULK INSERT is not available for {con.dialect.name}")
+        file_name = f"{table_name}-{uuid.uuid4().hex}.csv"
+        local_path = os.path.join(self.local_dir, file_name)
+        server_path = self.server_dir.rstrip("\\/") + ("\\" if "\\" in self.server_dir else "/") + file_name
+        self.write_csv(df, dtype_dict, local_path)
+        try:
+            con.execute(text(f"BULK INSERT [{schema}].[{table_name}] FROM '{server_path}' "
+                             f"WITH (FORMAT = 'CSV', FIELDTERMINATOR = ',', ROWTERMINATOR = '0x0a', BATCHSIZE = {self.batch_size}, TABLOCK)"))
+            self._commit(con)
+        finally:
+            if not self.keep_file:
+                os.remove(local_path)
+
+    #writes df the way BULK INSERT will parse it into the dtype_dict types: convert_dtypes leaves bit and int columns
+    #as float64, which would be written as 1.0, and DATETIME/SMALLDATETIME refuse more than 3 fractional digits
+    def write_csv(self, df: pd.DataFrame, dtype_dict: dict, path: str) -> None:
+        df = df.copy(deep=False)
+        for c in df.columns:
+            dtype = dtype_dict.get(c)
+            if isinstance(dtype, (Boolean, Integer)):
+                df[c] = df[c].astype("Int64")
+            elif isinstance(dtype, (Date, DateTime)) and pd.api.types.is_datetime64_any_dtype(df[c]):
+                df[c] = _format_datetimes(df[c], dtype)
+        df.to_csv(path, index=False, header=False, quoting=csv.QUOTE_MINIMAL, lineterminator="\n")
+
+
+LOADERS = {
+    ToSqlLoader.name: ToSqlLoader,
+    AdaptiveChunkLoader.name: AdaptiveChunkLoader,
+    ExecuteManyLoader.name: ExecuteManyLoader,
+    TruncateReuseLoader.name: TruncateReuseLoader,
+    BulkFileLoader.name: BulkFileLoader,
+}
+
+
+#the loader itself if it can append to an existing table, ValueError otherwise
+def require_append(loader: StagingLoader) -> StagingLoader:
+    if not loader.can_append:
+        raise ValueError(f"the {loader.name} loader can't append to an existing table, so it can't load chunks or partitions")
+    return loader
+
+
+#datetimes as text at the precision the column type accepts, missing values stay missing
+def _format_datetimes(col: pd.Series, dtype) -> pd.Series:
+    if isinstance(dtype, DATETIME2):
+        return col.dt.strftime("%Y-%m-%d %H:%M:%S.%f") # datetime2 holds 7 digits, pandas writes 6
+    if isinstance(dtype, DateTime): # DATETIME and SMALLDATETIME
+        return col.dt.strftime("%Y-%m-%d %H:%M:%S.%f").str[:-3]
+    return col.dt.strftime("%Y-%m-%d")
+
+
+#switches a DBAPI connection out of autocommit for one batch, returns a function that switches it back
+def _disable_autocommit(dbapi_con):
+    if getattr(dbapi_con, "autocommit", False) is True: # pyodbc
+        dbapi_con.autocommit = False
+        return lambda: setattr(dbapi_con, "autocommit", True)
+    if hasattr(dbapi_con, "isolation_level") and dbapi_con.isolation_level is None: # sqlite3
+        dbapi_con.isolation_level = "DEFERRED"
+        return lambda: setattr(dbapi_con, "isolation_level", None)
+    return lambda: None
+
+
+def _placeholders(paramstyle: str, count: int) -> list:
+    match paramstyle:
+        case "qmark":
+            return ["?"] * count
+        case "numeric":
+            return [f":{i + 1}" for i in range(count)]
+        case "named":
+            return [f":p{i}" for i in range(count)]
+        case _: # format / pyformat
+            return ["%s"] * count
+
+
+#DataFrame rows as tuples of plain python values with every missing value as None
+def _python_rows(df: pd.DataFrame) -> list:
+    converted = {}
+    for c in df.columns:
+        col = df[c]
+        if pd.api.types.is_datetime64_any_dtype(col):
+            values = pd.Series(col.dt.to_pydatetime(), index=col.index, dtype=object)
+        else:
+            values = col.astype(object)
+        converted[c] = values.where(col.notna(), None)
+    return list(zip(*converted.values())) if converted else []
+
+
+#(sql type, column size, decimal digits) per column for pyodbc's cursor.setinputsizes
+def pyodbc_input_sizes(columns, dtype_dict: dict) -> list:
+    import pyodbc
+
+    sizes = []
+    for c in columns:
+        dtype = dtype_dict.get(c)
+        match dtype:
+            case CHAR():
+                sizes.append((pyodbc.SQL_CHAR, dtype.length or 0, 0))
+            case UNIQUEIDENTIFIER():
+                sizes.append((pyodbc.SQL_VARCHAR, 36, 0))
+            case String():
+                sizes.append((pyodbc.SQL_VARCHAR, dtype.length or 0, 0)) # 0 means varchar(max)
+            case BIGINT() | BigInteger():
+                sizes.append((pyodbc.SQL_BIGINT, 0, 0))
+            case SmallInteger():
+                sizes.append((pyodbc.SQL_SMALLINT, 0, 0))
+            case Integer():
+                sizes.append((pyodbc.SQL_INTEGER, 0, 0))
+            case DECIMAL():
+                sizes.append((pyodbc.SQL_DECIMAL, dtype.precision or 18, dtype.scale or 0))
+            case Float():
+                sizes.append((pyodbc.SQL_FLOAT, 0, 0))
+            case Boolean():
+                sizes.append((pyodbc.SQL_BIT, 0, 0))
+            case DATETIME2():
+                sizes.append((pyodbc.SQL_TYPE_TIMESTAMP, 27, 7))
+            case SMALLDATETIME():
+                sizes.append((pyodbc.SQL_TYPE_TIMESTAMP, 16, 0))
+            case DateTime():
+                sizes.append((pyodbc.SQL_TYPE_TIMESTAMP, 23, 3))
+            case Date():
+                sizes.append((pyodbc.SQL_TYPE_DATE, 0, 0))
+            case _:
+                sizes.append(None) # let the driver decide
+    return sizes
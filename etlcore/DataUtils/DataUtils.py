@@ -1,3 +1,5 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from sqlalchemy import text
 from sqlalchemy.dialects.mssql import (
@@ -35,15 +37,144 @@ bool_type={
     1: True
 }
 
+NUMERIC_TYPES = (Integer, Float, BigInteger, DECIMAL, BIGINT, SmallInteger)
+DATETIME_TYPES = (Date, DateTime, DATETIME2, SMALLDATETIME)
+MAX_SIZED_STRING = 8000 # widest varchar(n), anything longer becomes varchar(max)
+
+#dtype dict compiled once into a list of (column, converter) steps, each converter works on a whole column at once
+#apply() converts a DataFrame with it and, like convert_dtypes always has, narrows String lengths in the dtype dict in place
+#columns convert independently so max_workers > 1 runs them on a thread pool, per column seconds are kept in timings
+#resize_strings=False keeps String lengths as given, for chunked loads where one chunk doesn't show the widest value
+class ConversionPlan():
+    def __init__(self, dtypes: dict, max_workers: int = 1, resize_strings: bool = True):
+        self.dtypes = dtypes
+        self.max_workers = max_workers
+        self.resize_strings = resize_strings
+        self.timings = {}
+        self.steps = []
+        for c, dtype in dtypes.items():
+            converter = self._converter(dtype)
+            if converter is not None:
+                self.steps.append((c, converter))
+
+    def _converter(self, dtype):
+        if isinstance(dtype, NUMERIC_TYPES):
+            return self._numeric
+        if isinstance(dtype, DATETIME_TYPES):
+            return self._datetime
+        if isinstance(dtype, Boolean):
+            return self._boolean
+        if isinstance(dtype, UNIQUEIDENTIFIER):
+            return None # NOOP
+        if isinstance(dtype, String):
+            return self._string
+        return None # unknown types are left as they are
+
+    def _numeric(self, c: str, col: pd.Series) -> pd.Series:
+        return pd.to_numeric(col, errors="coerce")
+
+    def _datetime(self, c: str, col: pd.Series) -> pd.Series:
+        return pd.to_datetime(col, errors="coerce")
+
+    def _boolean(self, c: str, col: pd.Series) -> pd.Series:
+        # Handle Yes/No/Null
+        return col.map(bool_type, na_action="ignore").astype("float64")
+
+    def _string(self, c: str, col: pd.Series) -> pd.Series:
+        if self.resize_strings:
+            self.resize_string(c, string_width(col))
+        return col
+
+    #sets the String length of column c from the widest value seen, the way convert_dtypes always has
+    def resize_string(self, c: str, col_length: int) -> None:
+        if self.dtypes[c].length is not None and col_length < MAX_SIZED_STRING:
+            self.dtypes[c] = String(col_length)
+            print("Updated column {} from String() to String({})".format(c, col_length))
+        else:
+            self.dtypes[c] = String()
+
+    def _run(self, c: str, converter, col: pd.Series) -> pd.Series:
+        start = time.perf_counter()
+        converted = converter(c, col)
+        self.timings[c] = time.perf_counter() - start
+        return converted
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        df = df.copy(deep=False) # new frame for the converted columns, the caller's data is not modified
+        if self.max_workers > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                futures = {c: pool.submit(self._run, c, converter, df[c]) for c, converter in self.steps}
+                converted = {c: future.result() for c, future in futures.items()}
+        else:
+            converted = {c: self._run(c, converter, df[c]) for c, converter in self.steps}
+        for c, col in converted.items():
+            df[c] = col
+        return df
+
+    #columns ordered slowest first
+    def slowest_columns(self, count: int = 10) -> list:
+        return sorted(self.timings.items(), key=lambda item: item[1], reverse=True)[:count]
+
+#length of the longest value in col, measured with the vectorized .str.len()
+def string_width(col: pd.Series) -> int:
+    if col.empty:
+        return 1
+    lengths = col.astype("string").str.len()
+    width = lengths.max()
+    return 1 if pd.isna(width) else max(int(width), 1)
+
+#maps a SQL Server column (as reported by spGet_TableSchema / INFORMATION_SCHEMA.COLUMNS) to a sqlalchemy type
+#returns None for types we don't load
+def sqlalchemy_type(data_type: str, character_maximum_length=None, numeric_precision=None, numeric_scale=None):
+    match data_type:
+        case "int":
+            return Integer()
+        case "bit":
+            return Boolean()
+        case "bigint":
+            return BIGINT()
+        case "date":
+            return Date()
+        case "float":
+            return Float(int(numeric_precision))
+        case "decimal":
+            return DECIMAL(precision=int(numeric_precision), scale=int(numeric_scale))
+        case "datetime":
+            return DateTime()
+        case "datetime2":
+            return DATETIME2()
+        case "smalldatetime":
+            return SMALLDATETIME()
+        case "char":
+            return CHAR(int(character_maximum_length))
+        case "text":
+            return String()
+        case "varchar":
+            if character_maximum_length == 'MAX':
+                return String(None)
+            else:
+                return String(int(character_maximum_length))
+        case "uniqueidentifier":
+            return UNIQUEIDENTIFIER()
+    return None
+
 class DataUtils():
-    def __init__(self, engine, org):
+    #schema_cache: optional etlcore.DataUtils.SchemaCache, when set table metadata comes from it instead of a query per call
+    def __init__(self, engine, org, schema_cache=None):
         self.engine = engine
         self.org = org
+        self.schema_cache = schema_cache
+        self.last_plan = None #ConversionPlan of the most recent convert_dtypes call, its timings feed slowest_columns()
+
+    def get_table_columns(self, db: str, schema: str, table_name: str) -> list:
+        if self.schema_cache is not None:
+            return self.schema_cache.get_columns(db, schema, table_name)
+        sql_df = pd.read_sql(text(f"SELECT TOP 1 * FROM {db}.{schema}.{table_name}"), con=self.engine.engine) # Retrieve a 1 row result set as template for table
+        return sql_df.columns.to_list()
 
     def preprocess_df(self, db: str, schema: str, table_name: str, raw_df: pd.DataFrame, dtype_dict: dict) -> pd.DataFrame:
         try:
-            sql_df = pd.read_sql(text(f"SELECT TOP 1 * FROM {db}.{schema}.{table_name}"), con=self.engine.engine) # Retrieve a 1 row result set as template for table
-            raw_df = raw_df[sql_df.columns.to_list()] #drop columns from raw_df that are not in list of columns from sql_df
+            raw_df = raw_df[self.get_table_columns(db, schema, table_name)] #drop columns from raw_df that are not in list of columns from the table
             cleaned_df = self.convert_dtypes(raw_df, dtype_dict) #converts all columns in raw_df to sqlalchemy dtypes
             return cleaned_df
         except Exception as e:
@@ -51,80 +182,24 @@ class DataUtils():
 
     def get_table_dtypes(self, db: str, db_schema: str, table_name: str) -> dict:
         try:
+            if self.schema_cache is not None:
+                return self.schema_cache.get_table_dtypes(db, db_schema, table_name)
             df = pd.read_sql(text(f"exec {db}.dbo.spGet_TableSchema {db_schema}, {table_name}"), con=self.engine.engine)
             table_dtypes = {} #stores sqlalchemy dtypes with column names in dictionary
             for row in df.itertuples(index=False):
-                match row.DATA_TYPE: 
-                    case "int":
-                        table_dtypes.update({row.COLUMN_NAME: Integer()})
-                    case "bit":
-                        table_dtypes.update({row.COLUMN_NAME: Boolean()})
-                    case "bigint":
-                        table_dtypes.update({row.COLUMN_NAME: BIGINT()})
-                    case "date":
-                        table_dtypes.update({row.COLUMN_NAME: Date()})
-                    case "float":
-                        table_dtypes.update({row.COLUMN_NAME: Float(int(row.NUMERIC_PRECISION))})
-                    case "decimal":
-                        table_dtypes.update({row.COLUMN_NAME: DECIMAL(precision=int(row.NUMERIC_PRECISION), scale=int(row.NUMERIC_SCALE))})
-                    case "datetime":
-                        table_dtypes.update({row.COLUMN_NAME: DateTime()})
-                    case "datetime2":
-                        table_dtypes.update({row.COLUMN_NAME: DATETIME2()})
-                    case "smalldatetime":
-                        table_dtypes.update({row.COLUMN_NAME: SMALLDATETIME()})
-                    case "char":
-                        table_dtypes.update({row.COLUMN_NAME: CHAR(int(row.CHARACTER_MAXIMUM_LENGTH))})
-                    case "text":
-                        table_dtypes.update({row.COLUMN_NAME: String()})
-                    case "varchar":
-                        if row.CHARACTER_MAXIMUM_LENGTH == 'MAX':
-                            table_dtypes.update({row.COLUMN_NAME: String(None)})
-                        else:
-                            table_dtypes.update({row.COLUMN_NAME: String(int(row.CHARACTER_MAXIMUM_LENGTH))})
-                    case "uniqueidentifier":
-                        table_dtypes.update({row.COLUMN_NAME: UNIQUEIDENTIFIER()})
+                dtype = sqlalchemy_type(row.DATA_TYPE, row.CHARACTER_MAXIMUM_LENGTH, row.NUMERIC_PRECISION, row.NUMERIC_SCALE)
+                if dtype is not None:
+                    table_dtypes.update({row.COLUMN_NAME: dtype})
             del df
             return table_dtypes
         except Exception as e:
             return f"unable to get table column types {str(e)}"
     
-    def convert_dtypes(self, df, dtypes):
+    #plan is a ConversionPlan to reuse (e.g. across the chunks of one table), built from dtypes when not given
+    def convert_dtypes(self, df, dtypes, max_workers: int = 1, plan: ConversionPlan = None):
         try:
-            for c in dtypes:
-                if type(dtypes[c]) in [
-                    type(Integer()),
-                    type(Float()),
-                    type(BigInteger()),
-                    type(DECIMAL()),
-                    type(BIGINT()),
-                    type(SmallInteger())
-                ]:
-                    df.loc[:, c] = pd.to_numeric(df.loc[:, c], errors="coerce")
-                elif type(dtypes[c]) in [
-                    type(Date()),
-                    type(DateTime()),
-                    type(DATETIME2()),
-                    type(SMALLDATETIME()),
-                ]:
-                    df.loc[:, c] = pd.to_datetime(df.loc[:, c], errors="coerce")
-                elif type(dtypes[c]) in [type(Boolean())]:
-                    # Handle Yes/No/Null
-                    df.loc[:, c] = df.loc[:, c].map(bool_type, na_action="ignore")
-                    df.loc[:, c] = df.loc[:, c].astype("float64")
-                elif type(dtypes[c]) in [type(UNIQUEIDENTIFIER())]:
-                    # NOOP
-                    pass
-                elif type(dtypes[c] in [type(String())]):
-                    col_length = max(df.loc[:, c].astype(str).apply(len))
-                    if dtypes[c].length is not None and col_length < 8000:
-                        dtypes[c] = String(col_length)
-                        print(
-                            "Updated column {} from String() to String({})".format(c, col_length)
-                        ) 
-                    else:
-                        dtypes[c] = String()
-            return df          
+            self.last_plan = plan or ConversionPlan(dtypes, max_workers)
+            return self.last_plan.apply(df)
         except Exception as e:
             return f"unable to convert column types {str(e)}"
 
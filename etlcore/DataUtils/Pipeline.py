@@ -0,0 +1,83 @@
+import time
+from typing import Iterable, Iterator
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.types import String
+
+from etlcore.DB.DB import DB
+from etlcore.DB.Loaders import ExecuteManyLoader, LoadResult, StagingLoader, require_append
+from etlcore.DataUtils.DataUtils import DataUtils, ConversionPlan, string_width, MAX_SIZED_STRING
+
+
+#DataFrame chunks from any binary file like object: a CX response, an S3 Body, an SFTP file or a local file
+def csv_chunks(stream, chunksize: int = 100000, **read_csv_kwargs) -> Iterator[pd.DataFrame]:
+    read_csv_kwargs.setdefault("dtype", object)
+    with pd.read_csv(stream, chunksize=chunksize, **read_csv_kwargs) as reader:
+        yield from reader
+
+
+#Runs preprocess_df -> convert_dtypes -> load_to_staging one chunk at a time so memory depends on chunk size, not file size
+#every chunk is projected to the table's columns, converted with one ConversionPlan and appended to RAW_{table_name}
+#string_widths="metadata" keeps the String lengths of the destination table, "running" sizes them from the widest value
+#seen so far and widens the staging column when a later chunk has a longer value
+#the table is readied once with loader.prepare and every chunk goes in with loader.append, loaders that can't append raise ValueError
+class ChunkedPipeline():
+    def __init__(self, db: DB, data_utils: DataUtils, loader: StagingLoader = None, string_widths: str = "metadata", max_workers: int = 1):
+        if string_widths not in ("metadata", "running"):
+            raise ValueError("string_widths must be 'metadata' or 'running'")
+        self.db = db
+        self.data_utils = data_utils
+        self.loader = require_append(loader or ExecuteManyLoader(create_table=False))
+        self.string_widths = string_widths
+        self.max_workers = max_workers
+        self.chunk_results = [] #LoadResult per chunk of the last run
+        self.last_load = None
+        self.dtype_dict = None #column types the staging table was loaded with, including running string widths
+
+    #db/schema/table_name is the destination table the metadata comes from, the chunks land in stage_schema.RAW_{table_name}
+    def run(self, chunks: Iterable[pd.DataFrame], db: str, schema: str, table_name: str, stage_schema: str, dtype_dict: dict = None) -> bool:
+        try:
+            dtype_dict = dict(dtype_dict or self.data_utils.get_table_dtypes(db, schema, table_name))
+            columns = self.data_utils.get_table_columns(db, schema, table_name)
+            plan = ConversionPlan(dtype_dict, self.max_workers, resize_strings=False)
+            string_columns = [c for c in columns if isinstance(dtype_dict.get(c), String)]
+            widths = {}
+            staging_table = f"RAW_{table_name}"
+
+            start = time.perf_counter()
+            self.chunk_results = []
+            for index, chunk in enumerate(chunks):
+                chunk = plan.apply(chunk[columns]) #drop columns that are not in the table
+                with self.db.connection() as con:
+                    if self.string_widths == "running":
+                        self._track_widths(con, chunk, string_columns, dtype_dict, widths, stage_schema, staging_table, created=index > 0)
+                    if index == 0:
+                        self.loader.prepare(con, chunk, stage_schema, staging_table, dtype_dict)
+                    self.chunk_results.append(self.loader.append(con, chunk, stage_schema, staging_table, dtype_dict))
+
+            self.dtype_dict = dtype_dict
+            if not self.chunk_results:
+                return "pipeline failed: no chunks to load"
+            self.last_load = LoadResult(f"chunked {self.loader.name}", f"{stage_schema}.{staging_table}",
+                                        sum(r.rows for r in self.chunk_results), time.perf_counter() - start)
+            print(self.last_load)
+            return True
+        except Exception as e:
+            return f"pipeline failed for {table_name}: {str(e)}"
+
+    #updates the running maximum width of every string column and widens the staging table when a chunk needs it
+    def _track_widths(self, con, chunk, string_columns, dtype_dict, widths, stage_schema, staging_table, created) -> None:
+        for c in string_columns:
+            if dtype_dict[c].length is None and c not in widths:
+                continue # varchar(max) in the table stays varchar(max)
+            width = string_width(chunk[c])
+            if width <= widths.get(c, 0):
+                continue
+            widths[c] = width
+            if width >= MAX_SIZED_STRING:
+                dtype_dict[c] = String()
+            else:
+                dtype_dict[c] = String(width)
+            if created and con.dialect.name == "mssql": # sqlite does not enforce varchar lengths
+                size = "MAX" if width >= MAX_SIZED_STRING else width
+                con.execute(text(f"ALTER TABLE [{stage_schema}].[{staging_table}] ALTER COLUMN [{c}] VARCHAR({size}) NULL"))
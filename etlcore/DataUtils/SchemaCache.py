@@ -0,0 +1,101 @@
+import os, json, time, threading
+import pandas as pd
+from sqlalchemy import text
+
+from etlcore.DataUtils.DataUtils import sqlalchemy_type
+
+COLUMNS_QUERY = """
+SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH, NUMERIC_PRECISION, NUMERIC_SCALE
+FROM {db}.INFORMATION_SCHEMA.COLUMNS
+WHERE TABLE_SCHEMA = :schema
+ORDER BY TABLE_NAME, ORDINAL_POSITION
+"""
+
+#Column metadata for whole schemas, fetched with one INFORMATION_SCHEMA query per schema instead of one per table
+#entries are kept in memory for ttl seconds and, with cache_path, written to a JSON file so the next process starts warm
+class SchemaCache():
+    def __init__(self, engine, ttl: int = 3600, cache_path: str = None):
+        self.engine = engine # a DB object, like DataUtils takes
+        self.ttl = ttl
+        self.cache_path = cache_path
+        self._lock = threading.RLock()
+        self._schemas = {} # "db.schema" -> {"fetched_at": float, "tables": {table: [column rows]}}
+        self._dtypes = {} # (db, schema, table) -> built sqlalchemy type map
+        if cache_path:
+            self._load()
+
+    def _key(self, db: str, schema: str) -> str:
+        return f"{db}.{schema}".lower()
+
+    def _load(self) -> None:
+        try:
+            with open(self.cache_path, "r") as f:
+                self._schemas = json.load(f)
+        except (OSError, ValueError):
+            self._schemas = {}
+
+    def _save(self) -> None:
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._schemas, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def _fetch_schema(self, db: str, schema: str) -> dict:
+        df = pd.read_sql(text(COLUMNS_QUERY.format(db=db)), con=self.engine.engine, params={"schema": schema})
+        tables = {}
+        for row in df.itertuples(index=False):
+            length = row.CHARACTER_MAXIMUM_LENGTH
+            tables.setdefault(row.TABLE_NAME.lower(), []).append({
+                "COLUMN_NAME": row.COLUMN_NAME,
+                "DATA_TYPE": row.DATA_TYPE,
+                "CHARACTER_MAXIMUM_LENGTH": "MAX" if length == -1 else (None if pd.isna(length) else int(length)), # same as spGet_TableSchema
+                "NUMERIC_PRECISION": None if pd.isna(row.NUMERIC_PRECISION) else int(row.NUMERIC_PRECISION),
+                "NUMERIC_SCALE": None if pd.isna(row.NUMERIC_SCALE) else int(row.NUMERIC_SCALE),
+            })
+        return {"fetched_at": time.time(), "tables": tables}
+
+    #column rows of one table, refreshing the whole schema when it is missing or older than ttl
+    def _table(self, db: str, schema: str, table_name: str) -> list:
+        key = self._key(db, schema)
+        with self._lock:
+            entry = self._schemas.get(key)
+            if entry is None or time.time() - entry["fetched_at"] > self.ttl:
+                entry = self._fetch_schema(db, schema)
+                self._schemas[key] = entry
+                self._dtypes = {k: v for k, v in self._dtypes.items() if k[:2] != (db.lower(), schema.lower())}
+                if self.cache_path:
+                    self._save()
+        columns = entry["tables"].get(table_name.lower())
+        if columns is None:
+            raise KeyError(f"{db}.{schema}.{table_name} was not found")
+        return columns
+
+    #column names of the table in ordinal order
+    def get_columns(self, db: str, schema: str, table_name: str) -> list:
+        return [column["COLUMN_NAME"] for column in self._table(db, schema, table_name)]
+
+    #same result as DataUtils.get_table_dtypes, a new dict each call since convert_dtypes updates it in place
+    def get_table_dtypes(self, db: str, schema: str, table_name: str) -> dict:
+        columns = self._table(db, schema, table_name)
+        key = (db.lower(), schema.lower(), table_name.lower())
+        with self._lock:
+            if key not in self._dtypes:
+                dtypes = {}
+                for column in columns:
+                    dtype = sqlalchemy_type(column["DATA_TYPE"], column["CHARACTER_MAXIMUM_LENGTH"], column["NUMERIC_PRECISION"], column["NUMERIC_SCALE"])
+                    if dtype is not None:
+                        dtypes[column["COLUMN_NAME"]] = dtype
+                self._dtypes[key] = dtypes
+            return dict(self._dtypes[key])
+
+    #drops cached metadata for one schema, or everything, e.g. after a deployment changed a table
+    def invalidate(self, db: str = None, schema: str = None) -> None:
+        with self._lock:
+            if db is None or schema is None:
+                self._schemas.clear()
+                self._dtypes.clear()
+            else:
+                self._schemas.pop(self._key(db, schema), None)
+                self._dtypes = {k: v for k, v in self._dtypes.items() if k[:2] != (db.lower(), schema.lower())}
+            if self.cache_path:
+                self._save()
@@ -0,0 +1,112 @@
+import io, time
+from typing import Union
+import pandas as pd
+from sqlalchemy.types import BigInteger, Boolean, Integer, SmallInteger, String
+
+from etlcore.DataUtils.DataUtils import bool_type, ConversionPlan, NUMERIC_TYPES, DATETIME_TYPES
+
+TRUE_VALUES = [k for k, v in bool_type.items() if v is True and isinstance(k, str)]
+FALSE_VALUES = [k for k, v in bool_type.items() if v is False and isinstance(k, str)]
+STRING_DTYPE = "string[pyarrow]" # a fraction of the memory of object strings, and the same dtype on every path
+
+
+#Turns a sqlalchemy type map (DataUtils.get_table_dtypes) into read_csv arguments so the file is parsed typed and projected in one pass
+#integers become nullable Int64, numerics float64, bits boolean (with the same Yes/No/1/0 spellings as convert_dtypes),
+#dates go to parse_dates and strings to pyarrow backed strings (STRING_DTYPE)
+#columns limits the read to those columns, by default the columns of dtype_dict
+def read_csv_options(dtype_dict: dict, columns: list = None, use_pyarrow: bool = False) -> dict:
+    wanted = list(columns or dtype_dict)
+    dtype = {}
+    parse_dates = []
+    for c in wanted:
+        sql_type = dtype_dict.get(c)
+        if isinstance(sql_type, (Integer, BigInteger, SmallInteger)):
+            dtype[c] = "Int64"
+        elif isinstance(sql_type, NUMERIC_TYPES):
+            dtype[c] = "float64"
+        elif isinstance(sql_type, DATETIME_TYPES):
+            parse_dates.append(c)
+        elif isinstance(sql_type, Boolean):
+            dtype[c] = "boolean"
+        elif isinstance(sql_type, String):
+            dtype[c] = STRING_DTYPE
+        else:
+            dtype[c] = object
+
+    options = {
+        "dtype": dtype,
+        "parse_dates": parse_dates,
+        "true_values": TRUE_VALUES,
+        "false_values": FALSE_VALUES,
+    }
+    if use_pyarrow:
+        options["engine"] = "pyarrow"
+        options["usecols"] = wanted # the pyarrow engine only takes a list
+    else:
+        wanted_set = set(wanted)
+        options["usecols"] = lambda c: c in wanted_set # ignores table columns the file doesn't have
+    return options
+
+
+#parse_dates leaves a column as object strings, without raising, when any value doesn't parse (a bad value, or mixed
+#formats like "2024-01-01" next to "2024-01-02 10:00"), so date columns that didn't come back as datetimes are converted
+#here with each value parsed on its own and unparseable values as NaT, the same coercion convert_dtypes applies
+def coerce_dates(df: pd.DataFrame, parse_dates: list) -> pd.DataFrame:
+    for c in parse_dates:
+        if c in df.columns and not pd.api.types.is_datetime64_any_dtype(df[c]):
+            df[c] = pd.to_datetime(df[c], errors="coerce", format="mixed")
+    return df
+
+
+#read_csv with read_csv_options, falling back to the dtype=object + convert_dtypes path when a value doesn't parse as its type
+#(the typed parser is strict where convert_dtypes coerces to null), the fallback needs a path, a seekable source
+#or reopen, a callable returning a fresh stream of the same data (e.g. a second GET for a streamed body)
+def read_typed_csv(source, dtype_dict: dict, columns: list = None, use_pyarrow: bool = False, reopen=None, **read_csv_kwargs) -> pd.DataFrame:
+    start = source.tell() if hasattr(source, "seek") and (not hasattr(source, "seekable") or source.seekable()) else None
+    options = read_csv_options(dtype_dict, columns, use_pyarrow)
+    try:
+        return coerce_dates(pd.read_csv(source, **options, **read_csv_kwargs), options["parse_dates"])
+    except (ValueError, TypeError) as e:
+        if start is None and reopen is None and not isinstance(source, str):
+            raise
+        print(f"typed read failed ({str(e)}), falling back to dtype=object")
+        if reopen is not None:
+            source = reopen()
+        elif start is not None:
+            source.seek(start)
+        df = pd.read_csv(source, dtype=object, **read_csv_kwargs)
+        wanted = [c for c in (columns or dtype_dict) if c in df.columns]
+        df = ConversionPlan(dict(dtype_dict)).apply(df[wanted])
+        return cast_like_typed(df, options["dtype"])
+
+
+#ConversionPlan leaves bit and int columns as float64, casts them (and strings) to the dtypes the typed read gives
+#so a column's dtype doesn't depend on which path read it, fractional values in an integer column become missing
+def cast_like_typed(df: pd.DataFrame, dtype: dict) -> pd.DataFrame:
+    for c, target in dtype.items():
+        if c not in df.columns or target is object:
+            continue
+        col = df[c]
+        if target == "Int64":
+            col = col.where(col % 1 == 0)
+        df[c] = col.astype(target)
+    return df
+
+
+#Times the current path (dtype=object then convert_dtypes) against typed parsing with the C and pyarrow engines
+#returns {path: {"seconds", "memory_bytes"}}, memory is the deep memory usage of the resulting DataFrame
+def compare_read_paths(source: Union[str, bytes], dtype_dict: dict) -> dict:
+    def open_source():
+        return io.BytesIO(source) if isinstance(source, bytes) else source
+
+    def measure(read) -> dict:
+        start = time.perf_counter()
+        df = read()
+        return {"seconds": time.perf_counter() - start, "memory_bytes": int(df.memory_usage(deep=True).sum())}
+
+    results = {
+        "object_then_convert": measure(lambda: ConversionPlan(dict(dtype_dict)).apply(pd.read_csv(open_source(), dtype=object)[list(dtype_dict)])),
+        "typed": measure(lambda: pd.read_csv(open_source(), **read_csv_options(dtype_dict))),
+        "typed_pyarrow": measure(lambda: pd.read_csv(open_source(), **read_csv_options(dtype_dict, use_pyarrow=True))),
+    }
+    return results
@@ -1,11 +1,21 @@
-import io
+import io, os
 import boto3
 import pandas as pd
+
+from etlcore.DataUtils.TypedReader import read_typed_csv, read_csv_options, coerce_dates
+from etlcore.S3.S3Listing import iter_pages, iter_objects, list_partitions, ListingIndex, ListingChanges
+from etlcore.S3.S3Transfer import transfer_config, TransferProgress, MultipartWriter, MULTIPART_CHUNK_SIZE, MAX_CONCURRENCY
+from etlcore.S3.S3Reader import file_format, open_stream, S3RangeFile
+from etlcore.S3.S3Bulk import BulkResult, delete_keys, copy_key, copy_prefix
 class S3():
-    def __init__(self, access_key: str, secret_key: str, bucket_name: str):
+    #chunk_size and max_concurrency are the multipart part size and number of parallel parts used by every transfer
+    def __init__(self, access_key: str, secret_key: str, bucket_name: str, chunk_size: int = MULTIPART_CHUNK_SIZE, max_concurrency: int = MAX_CONCURRENCY):
         self.access_key = access_key
         self.secret_key = secret_key
         self.bucket_name = bucket_name
+        self.chunk_size = chunk_size
+        self.max_concurrency = max_concurrency
+        self.last_transfer = None
         self.s3_client = self._create_s3_client()
 
     def _create_s3_client(self):
@@ -18,34 +28,99 @@ class S3():
         except Exception as e:
             return f"Failed to create s3 client: {str(e)}"
 
-    def list_files(self):
+    #same shape as a list_objects_v2 response but with every page merged, so buckets over 1000 keys are no longer truncated
+    def list_files(self, prefix: str = "", delimiter: str = None, start_after: str = None):
         try:
-            response = self.s3_client.list_objects_v2(Bucket=self.bucket_name) #https://awscli.amazonaws.com/v2/documentation/api/latest/reference/s3api/list-objects-v2.html
+            response = {"KeyCount": 0, "IsTruncated": False} #https://awscli.amazonaws.com/v2/documentation/api/latest/reference/s3api/list-objects-v2.html
+            contents, common_prefixes = [], []
+            for objects, prefixes in iter_pages(self.s3_client, self.bucket_name, prefix, delimiter, start_after): #one pass for both
+                contents.extend(objects)
+                common_prefixes.extend({"Prefix": p} for p in prefixes)
+            if contents:
+                response["Contents"] = contents
+            if common_prefixes:
+                response["CommonPrefixes"] = common_prefixes
+            response["KeyCount"] = len(contents) + len(common_prefixes)
             return response
         except Exception as e:
             return f"Failed to list out Contents of s3 bucket: {str(e)}"
 
-    def upload_file(self, s3_key: str, local_file_path: str):
+    #lazily yields object dicts page by page, nothing is held beyond the current page
+    def iter_files(self, prefix: str = "", delimiter: str = None, start_after: str = None):
+        return iter_objects(self.s3_client, self.bucket_name, prefix, delimiter, start_after)
+
+    #lists each prefix concurrently, returns {prefix: [objects]}
+    def list_partitions(self, prefixes: list, max_workers: int = 8) -> dict:
+        try:
+            return list_partitions(self.s3_client, self.bucket_name, prefixes, max_workers)
+        except Exception as e:
+            return f"Failed to list out Contents of s3 bucket: {str(e)}"
+
+    #what was added, changed or removed under prefix since the snapshot at index_path was last refreshed
+    #append_only=True only lists known partitions after their last seen key, see ListingIndex
+    def list_changes(self, index_path: str, prefix: str = "", delimiter: str = "/", append_only: bool = False, max_workers: int = 8) -> ListingChanges:
         try:
-            self.s3_client.upload_file(local_file_path, self.bucket_name, s3_key)
+            return ListingIndex(index_path).refresh(self.s3_client, self.bucket_name, prefix, delimiter, append_only, max_workers)
+        except Exception as e:
+            return f"Failed to list changes in s3 bucket: {str(e)}"
+
+    #on_progress(TransferProgress) is called periodically during the transfer and once at the end, self.last_transfer keeps the final numbers
+    def upload_file(self, s3_key: str, local_file_path: str, on_progress=None):
+        try:
+            progress = TransferProgress(s3_key, os.path.getsize(local_file_path), on_progress)
+            self.s3_client.upload_file(local_file_path, self.bucket_name, s3_key,
+                                       Config=transfer_config(self.chunk_size, self.max_concurrency), Callback=progress)
+            progress.finish()
+            self.last_transfer = progress
             print(
-                f"File uploaded successfully to S3 bucket '{self.bucket_name}' with key '{s3_key}'."
+                f"File uploaded successfully to S3 bucket '{self.bucket_name}' with key '{s3_key}'. {progress}"
             )
             return s3_key
         except Exception as e:
             return f"Failed to upload file: {str(e)}"
 
-    def download_file(self, s3_key: str, local_file_path: str):
+    def download_file(self, s3_key: str, local_file_path: str, on_progress=None):
         try:
-            self.s3_client.download_file(self.bucket_name, s3_key, local_file_path)
+            progress = TransferProgress(s3_key, on_progress=on_progress)
+            self.s3_client.download_file(self.bucket_name, s3_key, local_file_path,
+                                         Config=transfer_config(self.chunk_size, self.max_concurrency), Callback=progress)
+            progress.finish()
+            self.last_transfer = progress
             print(
-                f"File downloaded successfully from S3 bucket '{self.bucket_name}' with key '{s3_key}'."
+                f"File downloaded successfully from S3 bucket '{self.bucket_name}' with key '{s3_key}'. {progress}"
             )
             #TO DO: RETURN FILE PATH?
         except Exception as e:
            return f"Failed to download file: {str(e)}"
 
 
+    #encodes the dataframe straight into a multipart upload, no local file and at most max_concurrency parts held in memory
+    #file_format is "csv" or "parquet", extra kwargs go to DataFrame.to_csv or pyarrow.parquet.write_table
+    def upload_dataframe(self, df: pd.DataFrame, s3_key: str, file_format: str = "csv", on_progress=None, **kwargs):
+        try:
+            progress = TransferProgress(s3_key, on_progress=on_progress)
+            with MultipartWriter(self.s3_client, self.bucket_name, s3_key, self.chunk_size, self.max_concurrency, progress) as writer:
+                match file_format:
+                    case "csv":
+                        kwargs.setdefault("index", False)
+                        text = io.TextIOWrapper(writer, encoding="utf-8", newline="", write_through=True)
+                        df.to_csv(text, **kwargs)
+                        text.detach() # leave closing (and completing the upload) to the writer
+                    case "parquet":
+                        import pyarrow as pa
+                        import pyarrow.parquet as pq
+                        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), writer, **kwargs)
+                    case other:
+                        raise NotImplementedError("File type provided is not yet implemented!")
+            progress.finish()
+            self.last_transfer = progress
+            print(
+                f"Dataframe uploaded successfully to S3 bucket '{self.bucket_name}' with key '{s3_key}'. {progress}"
+            )
+            return s3_key
+        except Exception as e:
+            return f"Failed to upload dataframe: {str(e)}"
+
     def delete_file(self, s3_key: str) -> bool:
         try:
             self.s3_client.delete_object(Bucket=self.bucket_name, Key=s3_key)
@@ -56,10 +131,42 @@ class S3():
         except Exception as e:
             return f"Failed to delete file: {str(e)}"
 
+    #deletes up to 1000 keys per request, the result lists per key failures instead of stopping at the first one
+    def delete_files(self, s3_keys: list, max_workers: int = 4) -> BulkResult:
+        try:
+            result = delete_keys(self.s3_client, self.bucket_name, list(s3_keys), max_workers)
+            print(f"{result} in S3 bucket '{self.bucket_name}'.")
+            return result
+        except Exception as e:
+            return f"Failed to delete files: {str(e)}"
+
+    def delete_prefix(self, prefix: str, max_workers: int = 4) -> BulkResult:
+        try:
+            return self.delete_files([o["Key"] for o in self.iter_files(prefix)], max_workers)
+        except Exception as e:
+            return f"Failed to delete files: {str(e)}"
+
+    #server side copy of every key under source_prefix, objects over 5 GB are copied as multipart ranges
+    def copy_prefix(self, source_prefix: str, dest_prefix: str, dest_bucket: str = None, max_workers: int = 16) -> BulkResult:
+        try:
+            result = copy_prefix(self.s3_client, self.bucket_name, source_prefix, dest_prefix, dest_bucket, max_workers)
+            print(f"{result} from '{source_prefix}' to '{dest_prefix}'.")
+            return result
+        except Exception as e:
+            return f"Failed to copy files: {str(e)}"
+
+    #copy_prefix followed by a batched delete of the sources that copied, e.g. archiving a processed drop
+    def move_prefix(self, source_prefix: str, dest_prefix: str, dest_bucket: str = None, max_workers: int = 16) -> BulkResult:
+        try:
+            result = copy_prefix(self.s3_client, self.bucket_name, source_prefix, dest_prefix, dest_bucket, max_workers, delete_source=True)
+            print(f"{result} from '{source_prefix}' to '{dest_prefix}'.")
+            return result
+        except Exception as e:
+            return f"Failed to move files: {str(e)}"
+
     def rename_file(self, s3_key: str, new_s3_key: str) -> bool:
         try:
-            copy_source = {'Bucket': self.bucket_name, 'Key': s3_key} # you cannot rename objects in s3, so you need to copy to a new name and then delete the old one
-            self.s3_client.copy_object(CopySource = copy_source, Bucket = self.bucket_name, Key = new_s3_key)
+            copy_key(self.s3_client, self.bucket_name, s3_key, new_s3_key) # you cannot rename objects in s3, so you need to copy to a new name and then delete the old one
             self.s3_client.delete_object(Bucket = self.bucket_name, Key = s3_key)
             print(
                 f"File '{s3_key}' renamed successfully to '{new_s3_key}'."
@@ -68,22 +175,52 @@ class S3():
         except Exception as e:
             return f"Failed to rename file: {str(e)}"
 
-    def get_file_content(self, s3_key: str) -> pd.DataFrame:
+    #streams the object body into the parser instead of holding the raw file in memory, .gz/.bz2 keys are decompressed on the fly
+    def _open_body(self, s3_key: str, compression: str = None):
+        return open_stream(self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)["Body"], compression)
+
+    #dtype_dict: optional sqlalchemy type map (DataUtils.get_table_dtypes) to parse csv files typed and projected in one pass
+    #columns/row_groups: for parquet only those column chunks and row groups are fetched, with ranged GETs
+    def get_file_content(self, s3_key: str, dtype_dict: dict = None, use_pyarrow: bool = False, columns: list = None, row_groups: list = None) -> pd.DataFrame:
         try:
-            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)
-            chunks = (
-                chunk for chunk in response["Body"].iter_chunks(chunk_size=1024**3)
-            )  # This should prevent the 2GB download limit from a python ssl internal
-            data = io.BytesIO(b"".join(chunks))  # This keeps everything fully in memory
-            file_type = s3_key.split('.')[1]
+            file_type, compression = file_format(s3_key)
             match file_type:
                 case "csv":
-                    df = pd.read_csv(data)  # here you can provide also some necessary args and kwargs
+                    data = self._open_body(s3_key, compression)
+                    if dtype_dict:
+                        return read_typed_csv(data, dtype_dict, columns, use_pyarrow=use_pyarrow, reopen=lambda: self._open_body(s3_key, compression))
+                    df = pd.read_csv(data, usecols=columns)  # here you can provide also some necessary args and kwargs
                     return df
                 case "xlsx":
+                    data = io.BytesIO(self._open_body(s3_key, compression).read())  # the xlsx zip needs random access, so this one stays in memory
                     df = pd.read_excel(data)
                     return df
+                case "parquet":
+                    import pyarrow.parquet as pq
+                    parquet_file = pq.ParquetFile(S3RangeFile(self.s3_client, self.bucket_name, s3_key))
+                    if row_groups is not None:
+                        return parquet_file.read_row_groups(row_groups, columns=columns).to_pandas()
+                    return parquet_file.read(columns=columns).to_pandas()
                 case other:
                     raise NotImplementedError("File type provided is not yet implemented!")
         except Exception as e:
-            return f"Failed to get file content: {str(e)}"
\ No newline at end of file
+            return f"Failed to get file content: {str(e)}"
+
+    #yields DataFrames of at most chunksize rows so peak memory depends on the chunk size, not the object size
+    #csv is parsed straight off the body stream (typed when dtype_dict is given, without the dtype=object fallback),
+    #parquet is read one record batch at a time from the requested columns and row groups
+    def iter_file_content(self, s3_key: str, chunksize: int = 100000, dtype_dict: dict = None, columns: list = None, row_groups: list = None):
+        file_type, compression = file_format(s3_key)
+        match file_type:
+            case "csv":
+                options = read_csv_options(dtype_dict, columns) if dtype_dict else {"usecols": columns}
+                with pd.read_csv(self._open_body(s3_key, compression), chunksize=chunksize, **options) as reader:
+                    for chunk in reader:
+                        yield coerce_dates(chunk, options.get("parse_dates", []))
+            case "parquet":
+                import pyarrow.parquet as pq
+                parquet_file = pq.ParquetFile(S3RangeFile(self.s3_client, self.bucket_name, s3_key))
+                for batch in parquet_file.iter_batches(batch_size=chunksize, row_groups=row_groups, columns=columns):
+                    yield batch.to_pandas()
+            case other:
+                raise NotImplementedError("File type provided is not yet implemented!")
\ No newline at end of file
@@ -0,0 +1,111 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from etlcore.S3.S3Listing import iter_objects
+
+DELETE_BATCH_SIZE = 1000 # the most delete_objects accepts per request
+MULTIPART_COPY_THRESHOLD = 5 * 1024 ** 3 # copy_object refuses sources above 5 GB
+MULTIPART_COPY_PART_SIZE = 512 * 1024 ** 2
+MAX_PARTS = 10000
+
+
+#per key outcome of a bulk operation, failed maps key -> error message
+class BulkResult():
+    def __init__(self, operation: str):
+        self.operation = operation
+        self.succeeded = []
+        self.failed = {}
+        self.seconds = 0.0
+
+    def merge(self, other: "BulkResult") -> None:
+        self.succeeded.extend(other.succeeded)
+        self.failed.update(other.failed)
+
+    def __bool__(self):
+        return not self.failed
+
+    def __repr__(self):
+        return f"{self.operation}: {len(self.succeeded)} succeeded, {len(self.failed)} failed in {self.seconds:.2f}s"
+
+
+#deletes in batches of 1000 keys per request, batches are sent concurrently
+def delete_keys(s3_client, bucket: str, keys: list, max_workers: int = 4) -> BulkResult:
+    start = time.perf_counter()
+    def delete_batch(batch):
+        batch_result = BulkResult("delete")
+        try:
+            response = s3_client.delete_objects(Bucket=bucket, Delete={"Objects": [{"Key": k} for k in batch], "Quiet": True})
+            errors = {e["Key"]: f"{e.get('Code')}: {e.get('Message')}" for e in response.get("Errors", [])}
+        except Exception as e:
+            errors = {k: str(e) for k in batch}
+        batch_result.failed.update(errors)
+        batch_result.succeeded.extend(k for k in batch if k not in errors)
+        return batch_result
+
+    batches = [keys[i:i + DELETE_BATCH_SIZE] for i in range(0, len(keys), DELETE_BATCH_SIZE)]
+    result = BulkResult("delete")
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for batch_result in pool.map(delete_batch, batches):
+            result.merge(batch_result)
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+#server side copy, a single copy_object up to multipart_threshold and upload_part_copy ranges above it
+def copy_key(s3_client, bucket: str, source_key: str, dest_key: str, dest_bucket: str = None, size: int = None,
+             multipart_threshold: int = MULTIPART_COPY_THRESHOLD, part_size: int = MULTIPART_COPY_PART_SIZE) -> None:
+    dest_bucket = dest_bucket or bucket
+    copy_source = {"Bucket": bucket, "Key": source_key}
+    if size is None:
+        size = s3_client.head_object(Bucket=bucket, Key=source_key)["ContentLength"]
+    if size <= multipart_threshold:
+        s3_client.copy_object(CopySource=copy_source, Bucket=dest_bucket, Key=dest_key)
+        return
+
+    part_size = max(part_size, -(-size // MAX_PARTS))
+    upload_id = s3_client.create_multipart_upload(Bucket=dest_bucket, Key=dest_key)["UploadId"]
+    try:
+        parts = []
+        for part_number, offset in enumerate(range(0, size, part_size), start=1):
+            response = s3_client.upload_part_copy(Bucket=dest_bucket, Key=dest_key, UploadId=upload_id, PartNumber=part_number,
+                                                  CopySource=copy_source, CopySourceRange=f"bytes={offset}-{min(offset + part_size, size) - 1}")
+            parts.append({"PartNumber": part_number, "ETag": response["CopyPartResult"]["ETag"]})
+        s3_client.complete_multipart_upload(Bucket=dest_bucket, Key=dest_key, UploadId=upload_id, MultipartUpload={"Parts": parts})
+    except Exception:
+        s3_client.abort_multipart_upload(Bucket=dest_bucket, Key=dest_key, UploadId=upload_id)
+        raise
+
+
+#copies every key under source_prefix to the same relative key under dest_prefix, objects are copied concurrently
+#delete_source=True makes it a move: only sources that copied successfully are deleted, in batches
+#the listing is finished before anything is copied and, within one bucket, keys already under dest_prefix are skipped,
+#so archiving into a sub folder of the source (in/ -> in/archive/) never picks up its own output
+def copy_prefix(s3_client, bucket: str, source_prefix: str, dest_prefix: str, dest_bucket: str = None, max_workers: int = 16,
+                delete_source: bool = False, multipart_threshold: int = MULTIPART_COPY_THRESHOLD) -> BulkResult:
+    start = time.perf_counter()
+    def copy_object(obj):
+        dest_key = dest_prefix + obj["Key"][len(source_prefix):]
+        try:
+            copy_key(s3_client, bucket, obj["Key"], dest_key, dest_bucket, obj["Size"], multipart_threshold)
+            return obj["Key"], None
+        except Exception as e:
+            return obj["Key"], str(e)
+
+    objects = list(iter_objects(s3_client, bucket, source_prefix))
+    if dest_bucket in (None, bucket) and dest_prefix.startswith(source_prefix):
+        objects = [obj for obj in objects if not obj["Key"].startswith(dest_prefix)]
+
+    result = BulkResult("move" if delete_source else "copy")
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for key, error in pool.map(copy_object, objects):
+            if error is None:
+                result.succeeded.append(key)
+            else:
+                result.failed[key] = error
+
+    if delete_source and result.succeeded:
+        deleted = delete_keys(s3_client, bucket, result.succeeded)
+        result.succeeded = deleted.succeeded
+        result.failed.update({k: f"copied but not deleted: {error}" for k, error in deleted.failed.items()})
+    result.seconds = time.perf_counter() - start
+    return result
@@ -0,0 +1,116 @@
+import os, json
+from concurrent.futures import ThreadPoolExecutor
+
+LIST_PAGE_SIZE = 1000 # the most list_objects_v2 returns per call
+
+
+#yields one page at a time as (objects, common prefixes), following continuation tokens until the listing is complete
+def iter_pages(s3_client, bucket: str, prefix: str = "", delimiter: str = None, start_after: str = None, page_size: int = LIST_PAGE_SIZE):
+    kwargs = {"Bucket": bucket, "Prefix": prefix, "MaxKeys": page_size}
+    if delimiter:
+        kwargs["Delimiter"] = delimiter
+    if start_after:
+        kwargs["StartAfter"] = start_after
+    while True:
+        response = s3_client.list_objects_v2(**kwargs)
+        yield response.get("Contents", []), [p["Prefix"] for p in response.get("CommonPrefixes", [])]
+        if not response.get("IsTruncated"):
+            return
+        kwargs["ContinuationToken"] = response["NextContinuationToken"]
+        kwargs.pop("StartAfter", None)
+
+
+def iter_objects(s3_client, bucket: str, prefix: str = "", delimiter: str = None, start_after: str = None, page_size: int = LIST_PAGE_SIZE):
+    for objects, _ in iter_pages(s3_client, bucket, prefix, delimiter, start_after, page_size):
+        yield from objects
+
+
+def iter_prefixes(s3_client, bucket: str, prefix: str = "", delimiter: str = "/"):
+    for _, prefixes in iter_pages(s3_client, bucket, prefix, delimiter):
+        yield from prefixes
+
+
+#lists several prefixes at once, returns {prefix: [objects]}
+#start_after maps a prefix to the key its listing should start after
+def list_partitions(s3_client, bucket: str, prefixes: list, max_workers: int = 8, start_after: dict = None) -> dict:
+    start_after = start_after or {}
+    def list_partition(prefix):
+        return prefix, list(iter_objects(s3_client, bucket, prefix, start_after=start_after.get(prefix)))
+    if max_workers <= 1 or len(prefixes) <= 1:
+        return dict(list_partition(prefix) for prefix in prefixes)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return dict(pool.map(list_partition, prefixes))
+
+
+class ListingChanges():
+    def __init__(self):
+        self.new = []
+        self.modified = []
+        self.deleted = []
+        self.scanned_prefixes = []
+
+    def __bool__(self):
+        return bool(self.new or self.modified or self.deleted)
+
+    def __repr__(self):
+        return f"{len(self.new)} new, {len(self.modified)} modified, {len(self.deleted)} deleted across {len(self.scanned_prefixes)} scanned prefixes"
+
+
+#local snapshot of bucket listings, kept per bucket with one entry per partition (the prefixes one delimiter level below the root prefix)
+#one index file can track several buckets and root prefixes, a refresh only touches the partitions under its own prefix
+#append_only=True assumes keys are only ever added to a partition in sorted order (date stamped drops), so a known partition
+#is only listed after its last seen key and unchanged partitions cost one empty request instead of a full scan
+class ListingIndex():
+    def __init__(self, path: str):
+        self.path = path
+        self.buckets = {} # bucket -> partition -> key -> [etag, size]
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.buckets = json.load(f)
+
+    def save(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.buckets, f)
+        os.replace(temp_path, self.path)
+
+    def refresh(self, s3_client, bucket: str, prefix: str = "", delimiter: str = "/", append_only: bool = False, max_workers: int = 8) -> ListingChanges:
+        changes = ListingChanges()
+        known = self.buckets.setdefault(bucket, {})
+        root_objects, partitions = [], []
+        for objects, prefixes in iter_pages(s3_client, bucket, prefix, delimiter):
+            root_objects.extend(objects)
+            partitions.extend(prefixes)
+        self._compare(known, prefix, root_objects, changes, full_scan=True) # keys directly under the root prefix
+
+        start_after = {}
+        if append_only:
+            start_after = {p: max(known[p]) for p in partitions if known.get(p)}
+        listings = list_partitions(s3_client, bucket, partitions, max_workers, start_after)
+        for partition, objects in listings.items():
+            self._compare(known, partition, objects, changes, full_scan=partition not in start_after)
+            changes.scanned_prefixes.append(partition)
+
+        removed = {p for p in known if p.startswith(prefix)} - set(partitions) - {prefix} # partitions of other prefixes are left alone
+        for partition in removed: # whole partition removed
+            changes.deleted.extend(known.pop(partition))
+        self.save()
+        return changes
+
+    def _compare(self, partitions: dict, partition: str, objects: list, changes: ListingChanges, full_scan: bool) -> None:
+        known = partitions.get(partition, {})
+        current = {o["Key"]: [o["ETag"], o["Size"]] for o in objects}
+        for key, state in current.items():
+            if key not in known:
+                changes.new.append(key)
+            elif known[key] != state:
+                changes.modified.append(key)
+        if full_scan:
+            changes.deleted.extend(key for key in known if key not in current)
+            partitions[partition] = current
+        else:
+            known.update(current)
+            partitions[partition] = known
@@ -0,0 +1,72 @@
+import io, bz2, gzip, posixpath
+
+COMPRESSIONS = {".gz": "gzip", ".gzip": "gzip", ".bz2": "bz2"}
+
+
+#("csv", "gzip") for exports/2024.01/file.csv.gz, only the file name's own extensions count
+def file_format(key: str) -> tuple:
+    name = posixpath.basename(key).lower()
+    stem, extension = posixpath.splitext(name)
+    compression = COMPRESSIONS.get(extension)
+    if compression:
+        stem, extension = posixpath.splitext(stem)
+    return extension.lstrip("."), compression
+
+
+#decompresses a streaming body on the fly, nothing is buffered beyond the decompressor's window
+def open_stream(body, compression: str = None):
+    match compression:
+        case "gzip":
+            return gzip.GzipFile(fileobj=body, mode="rb")
+        case "bz2":
+            return bz2.BZ2File(body, mode="rb")
+        case _:
+            return body
+
+
+#read-only seekable file over an S3 object where every read is a ranged GET,
+#lets pyarrow read a parquet footer and then only the column chunks it needs
+class S3RangeFile(io.RawIOBase):
+    def __init__(self, s3_client, bucket: str, key: str, size: int = None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.size = size if size is not None else s3_client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+        self.position = 0
+        self.requests = 0
+        self.bytes_fetched = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        match whence:
+            case io.SEEK_SET:
+                self.position = offset
+            case io.SEEK_CUR:
+                self.position += offset
+            case io.SEEK_END:
+                self.position = self.size + offset
+        return self.position
+
+    def read(self, size: int = -1) -> bytes:
+        end = self.size if size is None or size < 0 else min(self.position + size, self.size)
+        if self.position >= end:
+            return b""
+        response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={self.position}-{end - 1}")
+        data = response["Body"].read()
+        self.requests += 1
+        self.bytes_fetched += len(data)
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
@@ -0,0 +1,120 @@
+import io, time, threading
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
+
+MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+MULTIPART_MIN_CHUNK_SIZE = 5 * 1024 * 1024 # S3 rejects smaller parts except the last one
+MAX_CONCURRENCY = 10
+
+
+def transfer_config(chunk_size: int = MULTIPART_CHUNK_SIZE, max_concurrency: int = MAX_CONCURRENCY) -> TransferConfig:
+    return TransferConfig(multipart_threshold=chunk_size, multipart_chunksize=chunk_size, max_concurrency=max_concurrency)
+
+
+#boto3 transfer callback: counts bytes from every worker thread and reports throughput
+#on_progress(progress) is called at most every report_interval seconds and once more when finish() is called
+class TransferProgress():
+    def __init__(self, label: str, total: int = None, on_progress=None, report_interval: float = 5.0):
+        self.label = label
+        self.total = total
+        self.on_progress = on_progress
+        self.report_interval = report_interval
+        self.transferred = 0
+        self.start = time.perf_counter()
+        self.seconds = 0.0
+        self._last_report = self.start
+        self._lock = threading.Lock()
+
+    def __call__(self, bytes_amount: int) -> None:
+        with self._lock:
+            self.transferred += bytes_amount
+            now = time.perf_counter()
+            self.seconds = now - self.start
+            if self.on_progress and now - self._last_report >= self.report_interval:
+                self._last_report = now
+                self.on_progress(self)
+
+    def finish(self) -> None:
+        self.seconds = time.perf_counter() - self.start
+        if self.on_progress:
+            self.on_progress(self)
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.transferred / 1024 ** 2 / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        total = f"/{self.total}" if self.total is not None else ""
+        return f"{self.label}: {self.transferred}{total} bytes in {self.seconds:.2f}s ({self.mb_per_second:.2f} MB/s)"
+
+
+#write-only file object backed by a multipart upload: every chunk_size bytes written become one part,
+#uploaded on a bounded thread pool so at most max_concurrency parts are buffered at a time
+#closing completes the upload, abort() (or an exception inside a with block) discards it
+class MultipartWriter(io.RawIOBase):
+    def __init__(self, s3_client, bucket: str, key: str, chunk_size: int = MULTIPART_CHUNK_SIZE,
+                 max_concurrency: int = MAX_CONCURRENCY, callback=None, **create_kwargs):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.chunk_size = max(chunk_size, MULTIPART_MIN_CHUNK_SIZE)
+        self.callback = callback
+        self.upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=key, **create_kwargs)["UploadId"]
+        self._buffer = bytearray()
+        self._futures = []
+        self._slots = threading.Semaphore(max_concurrency)
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._aborted = False
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            self._submit(bytes(self._buffer[:self.chunk_size]))
+            del self._buffer[:self.chunk_size]
+        return len(data)
+
+    def _submit(self, body: bytes) -> None:
+        self._slots.acquire() # blocks the writer instead of buffering unbounded parts
+        part_number = len(self._futures) + 1
+        self._futures.append(self._pool.submit(self._upload_part, part_number, body))
+
+    def _upload_part(self, part_number: int, body: bytes) -> dict:
+        try:
+            response = self.s3_client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=part_number, Body=body)
+            if self.callback:
+                self.callback(len(body))
+            return {"PartNumber": part_number, "ETag": response["ETag"]}
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            if not self._aborted:
+                if self._buffer or not self._futures: # the last part may be short, and an empty object still needs one part
+                    self._submit(bytes(self._buffer))
+                    self._buffer.clear()
+                parts = [future.result() for future in self._futures]
+                self.s3_client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": parts})
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self._pool.shutdown(wait=True)
+            super().close()
+
+    def abort(self) -> None:
+        if self._aborted:
+            return
+        self._aborted = True
+        self._pool.shutdown(wait=True)
+        self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        self.close()
@@ -1,9 +1,16 @@
-import os
+import os, csv
 import paramiko
 from io import StringIO
 from paramiko import SFTPClient
 import pandas as pd
 
+from etlcore.DataUtils.TypedReader import read_typed_csv
+from etlcore.SFTP.SFTPTransfer import SFTPTransferPool
+from etlcore.SFTP.SFTPSync import SFTPSync, DOWNLOAD_MANIFEST, UPLOAD_MANIFEST
+
+VALIDATE_PREFIX_BYTES = 64 * 1024 # enough for the header and a few rows
+ROW_COUNT_BLOCK_BYTES = 4 * 1024 * 1024
+
 class SFTP():
     def __init__(self, host: str, username: str, password: str, key: str = None, port: int = 22):
         self.host = host
@@ -24,12 +31,14 @@ class SFTP():
                 pem = StringIO(self.key.replace('\\n', '\n')) # Create RSA Private Key File in memory.
                 pkey=paramiko.RSAKey.from_private_key(pem, self.password) # returns PKey Object
                 ssh.connect(hostname=self.host, 
+                            port=self.port,
                             username=self.username, 
                             pkey=pkey, 
                             passphrase=self.password, 
                             allow_agent=False)
             else: 
                 ssh.connect(hostname=self.host,
+                            port=self.port,
                             username=self.username,
                             password=self.password,
                             allow_agent=False)
@@ -46,6 +55,20 @@ class SFTP():
         except Exception as e:
             return f"failed to disconnect from host {self.host}"
 
+    #extra SFTP channels on this connection's transport for concurrent transfers, close it (or use it as a context manager) when done
+    def transfer_pool(self, channels: int = 4, **options) -> SFTPTransferPool:
+        return SFTPTransferPool(self.connection.get_channel().get_transport(), channels, **options)
+
+    #moves (source, destination) pairs over a pool of channels, returns an error string naming the files that failed
+    def _transfer_concurrently(self, direction: str, jobs: list, max_workers: int) -> bool:
+        with self.transfer_pool(min(max_workers, max(len(jobs), 1))) as pool:
+            summary = pool.run(direction, jobs)
+        self.last_transfer = summary
+        print(f"{direction} from host '{self.host}': {summary}")
+        if summary.failed:
+            return f"Failed to {direction} {len(summary.failed)} files: " + "; ".join(repr(r) for r in summary.failed)
+        return True
+
     def list_dir_contents(self, remote_path: str) -> set:
         try:
             files = set([file for file in self.connection.listdir(remote_path)]) #set because it should not change
@@ -60,25 +83,73 @@ class SFTP():
         except Exception as e:
             return f"Failed to list out files from directory: {str(e)}"
         
-    def validate_file(self, remote_path: str) -> bool:
-        try:
-            if self.connection.exists(remote_path):
-                print("file is present")
-                num_lines = 0
-                
-                with self.connection.open(remote_path, mode = 'r') as target_file: #count the number of lines in the file to see if its empty
-                    for line in target_file:
-                        num_lines = num_lines + 1
-                if num_lines > 0:
-                    return True
-                else:
+    #checks a remote file without downloading it: stat for existence and size, and a small prefix read for the header
+    #header=True treats a file with only a header line as empty, expected_columns are header names that must be present
+    #rows are only counted (a full binary scan) when count_rows, min_rows or expected_rows is given
+    def validate_file(self, remote_path: str, min_size: int = 1, header: bool = False, expected_columns: list = None, delimiter: str = ",",
+                      min_rows: int = None, expected_rows: int = None, count_rows: bool = False) -> bool:
+        try:
+            try:
+                size = self.connection.stat(remote_path).st_size
+            except FileNotFoundError:
+                print(f"file {remote_path} is not present")
+                return False
+            print("file is present")
+
+            if size == 0:
+                print("file is present but empty")
+                return False
+            if size < min_size:
+                print(f"file is {size} bytes, expected at least {min_size}")
+                return False
+
+            if header or expected_columns:
+                with self.connection.open(remote_path, mode="rb") as target_file:
+                    prefix = target_file.read(VALIDATE_PREFIX_BYTES)
+                lines = [line for line in prefix.splitlines() if line.strip()]
+                if not lines:
                     print("file is present but empty")
                     return False
-            else:
-                return FileNotFoundError()
+                if expected_columns:
+                    columns = next(csv.reader([lines[0].decode("utf-8-sig", errors="replace")], delimiter=delimiter))
+                    missing = [c for c in expected_columns if c not in columns]
+                    if missing:
+                        print(f"file header is missing columns {missing}")
+                        return False
+                if header and len(lines) == 1 and size <= len(prefix):
+                    print("file only has a header")
+                    return False
+
+            if count_rows or min_rows is not None or expected_rows is not None:
+                rows = self.count_rows(remote_path) - (1 if header or expected_columns else 0)
+                print(f"file has {rows} rows")
+                if min_rows is not None and rows < min_rows:
+                    return False
+                if expected_rows is not None and rows != expected_rows:
+                    return False
+            return True
 
         except Exception as e:
-            return f"Unable to validate file at {remote_path}: {str(e)}"
+            print(f"Unable to validate file at {remote_path}: {str(e)}")
+            return False # a message string would be truthy and read as a pass
+
+    #number of lines in the remote file, read in large prefetched binary blocks instead of line by line in text mode
+    #quoted fields that contain line breaks are counted as extra lines
+    def count_rows(self, remote_path: str) -> int:
+        size = self.connection.stat(remote_path).st_size
+        lines = 0
+        last = b""
+        with self.connection.open(remote_path, mode="rb", bufsize=ROW_COUNT_BLOCK_BYTES) as target_file:
+            target_file.prefetch(size) # request every block up front so the reads are pipelined
+            while True:
+                block = target_file.read(ROW_COUNT_BLOCK_BYTES)
+                if not block:
+                    break
+                lines += block.count(b"\n")
+                last = block[-1:]
+        if last and last != b"\n": # last line without a line break
+            lines += 1
+        return lines
 
     def upload_file(self, local_file_path: str, remote_path: str) -> bool:
         try:
@@ -94,8 +165,12 @@ class SFTP():
 
     #this function assumes you have no sub folders or folders of any kind in the directory
     #while this IS our use case, if you worry about folders being added use "create_and_upload_dir()" instead
-    def upload_dir_contents(self, local_dir_path: str, remote_dir_path: str) -> bool:
+    #max_workers > 1 transfers the files concurrently over that many SFTP channels
+    def upload_dir_contents(self, local_dir_path: str, remote_dir_path: str, max_workers: int = 1) -> bool:
         try:
+            if max_workers > 1:
+                jobs = [(os.path.join(local_dir_path, file), os.path.join(remote_dir_path, file)) for file in os.listdir(local_dir_path)]
+                return self._transfer_concurrently("upload", jobs, max_workers)
             for file in os.listdir(local_dir_path): #iterate over files in directory
                 remote_path = os.path.join(remote_dir_path, file)
                 local_path = os.path.join(local_dir_path, file)
@@ -113,13 +188,16 @@ class SFTP():
             return True
 
 
-    def create_and_upload_dir(self, local_dir_path: str, remote_dir_path: str) -> bool:
+    def create_and_upload_dir(self, local_dir_path: str, remote_dir_path: str, max_workers: int = 1) -> bool:
         try:
             dir_name = local_dir_path 
             if "/" in dir_name:
                 dir_name = local_dir_path.rsplit('/',1)[1]
             remote_dir_to_create = os.path.join(remote_dir_path, dir_name)
             self.create_dir(remote_dir_to_create) #create new remote directory in desired location
+            if max_workers > 1:
+                jobs = [(os.path.join(local_dir_path, file), os.path.join(remote_dir_to_create, file)) for file in os.listdir(local_dir_path)]
+                return self._transfer_concurrently("upload", jobs, max_workers)
 
             for file in os.listdir(local_dir_path): #iterate over files in starting directory
                 remote_path = os.path.join(remote_dir_to_create, file) 
@@ -146,8 +224,12 @@ class SFTP():
 
     #this function assumes you have no sub folders or folders of any kind in the remote directory
     #while this IS our use case, if you worry about folders being added use "create_and_upload_dir()" instead
-    def download_dir_contents(self, remote_dir_path: str, local_dir_path: str) -> bool:
+    #max_workers > 1 transfers the files concurrently over that many SFTP channels
+    def download_dir_contents(self, remote_dir_path: str, local_dir_path: str, max_workers: int = 1) -> bool:
         try:
+            if max_workers > 1:
+                jobs = [(os.path.join(remote_dir_path, file.filename), os.path.join(local_dir_path, file.filename)) for file in self.connection.listdir_attr(remote_dir_path)]
+                return self._transfer_concurrently("download", jobs, max_workers)
             for file in self.connection.listdir_attr(remote_dir_path): #iterate over files in directory
                 remote_path = os.path.join(remote_dir_path, file.filename) 
                 local_path = os.path.join(local_dir_path, file.filename)
@@ -157,7 +239,7 @@ class SFTP():
             return f"Failed to upload directory contents: {str(e)}"
 
     #https://stackoverflow.com/questions/50118919/python-pysftp-get-r-from-linux-works-fine-on-linux-but-not-on-windows    
-    def download_full_dir_contents(self, remote_dir_path: str, local_dir_path: str) -> bool:
+    def download_full_dir_contents(self, remote_dir_path: str, local_dir_path: str, max_workers: int = 1) -> bool:
         try:
             dir_name = remote_dir_path 
             if "/" in dir_name:
@@ -167,6 +249,9 @@ class SFTP():
                 os.makedirs(local_dir_to_create)
             except Exception as e:
                 return f"Failed to create new directory for downloaded file: {str(e)}"  
+            if max_workers > 1:
+                jobs = [(os.path.join(remote_dir_path, file.filename), os.path.join(local_dir_to_create, file.filename)) for file in self.connection.listdir_attr(remote_dir_path)]
+                return self._transfer_concurrently("download", jobs, max_workers)
             for file in self.connection.listdir_attr(remote_dir_path): #iterate over files in starting directory
                 remote_path = os.path.join(remote_dir_path, file.filename) 
                 local_path = os.path.join(local_dir_to_create, file.filename)
@@ -175,6 +260,33 @@ class SFTP():
         except Exception as e:
             return f"Failed to upload directory: {str(e)}"
 
+    #incremental download of a whole remote tree, sub folders included: only files whose size or mtime changed since
+    #the last run are fetched and interrupted downloads resume. the manifest defaults to a file inside local_dir_path
+    def sync_download(self, remote_dir_path: str, local_dir_path: str, manifest_path: str = None, max_workers: int = 1) -> bool:
+        try:
+            sync = SFTPSync(self.connection, manifest_path or os.path.join(local_dir_path, DOWNLOAD_MANIFEST), max_workers)
+            summary = sync.download(remote_dir_path, local_dir_path)
+            self.last_transfer = summary
+            print(f"sync from host '{self.host}': {summary}, {sync.skipped} unchanged")
+            if summary.failed:
+                return f"Failed to download {len(summary.failed)} files: " + "; ".join(repr(r) for r in summary.failed)
+            return True
+        except Exception as e:
+            return f"Failed to sync directory: {str(e)}"
+
+    #incremental upload of a whole local tree, remote sub folders are created as needed
+    def sync_upload(self, local_dir_path: str, remote_dir_path: str, manifest_path: str = None, max_workers: int = 1) -> bool:
+        try:
+            sync = SFTPSync(self.connection, manifest_path or os.path.join(local_dir_path, UPLOAD_MANIFEST), max_workers)
+            summary = sync.upload(local_dir_path, remote_dir_path)
+            self.last_transfer = summary
+            print(f"sync to host '{self.host}': {summary}, {sync.skipped} unchanged")
+            if summary.failed:
+                return f"Failed to upload {len(summary.failed)} files: " + "; ".join(repr(r) for r in summary.failed)
+            return True
+        except Exception as e:
+            return f"Failed to sync directory: {str(e)}"
+
     def delete_file(self, remote_file_path: str) -> bool:
         try:
             self.connection.remove(remote_file_path)
@@ -196,12 +308,16 @@ class SFTP():
         except Exception as e:
             return f"Failed to rename file: {str(e)}"
         
-    def get_file_content(self, remote_file_path: str) -> pd.DataFrame:
+    #dtype_dict: optional sqlalchemy type map (DataUtils.get_table_dtypes) to parse csv files typed and projected in one pass
+    def get_file_content(self, remote_file_path: str, dtype_dict: dict = None, use_pyarrow: bool = False) -> pd.DataFrame:
         try:
             with self.connection.open(remote_file_path, "r") as file:
                 file_type = remote_file_path.split('.')[1]
                 match file_type:
                     case "csv":
+                        if dtype_dict:
+                            file.prefetch() # read ahead in parallel, the whole file is parsed anyway
+                            return read_typed_csv(file, dtype_dict, use_pyarrow=use_pyarrow, encoding="utf-8")
                         df = pd.read_csv(file, encoding="utf-8")  # here you can provide also some necessary args and kwargs
                         return df
                     case "xlsx":
@@ -0,0 +1,212 @@
+import os, json, stat, time, posixpath, threading
+from concurrent.futures import ThreadPoolExecutor
+from paramiko import SFTPClient
+
+from etlcore.SFTP.SFTPTransfer import SFTPTransferPool, TransferResult, TransferSummary
+
+SYNC_BLOCK_SIZE = 1024 * 1024
+PARTIAL_SUFFIX = ".part"
+DOWNLOAD_MANIFEST = ".sftp_download_manifest.json"
+UPLOAD_MANIFEST = ".sftp_upload_manifest.json"
+
+
+#size and mtime of every file already synced, plus the source state a partial transfer was started against
+#a partial is only resumed while its source still has that size and mtime
+class SyncManifest():
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.files = {}
+        self.partial = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                data = json.load(f)
+            self.files = data.get("files", {})
+            self.partial = data.get("partial", {})
+
+    def unchanged(self, relative_path: str, size: int, mtime: int) -> bool:
+        return self.files.get(relative_path) == {"size": size, "mtime": mtime}
+
+    def resumable(self, relative_path: str, size: int, mtime: int) -> bool:
+        return self.partial.get(relative_path) == {"size": size, "mtime": mtime}
+
+    def start(self, relative_path: str, size: int, mtime: int) -> None:
+        with self._lock:
+            self.partial[relative_path] = {"size": size, "mtime": mtime}
+            self._save()
+
+    def complete(self, relative_path: str, size: int, mtime: int) -> None:
+        with self._lock:
+            self.partial.pop(relative_path, None)
+            self.files[relative_path] = {"size": size, "mtime": mtime}
+            self._save()
+
+    #written to a temp file and swapped in so an interrupted run never leaves a truncated manifest
+    def _save(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"files": self.files, "partial": self.partial}, f)
+        os.replace(temp_path, self.path)
+
+
+def _sync_file(name: str) -> bool:
+    return not (name.endswith(PARTIAL_SUFFIX) or name in (DOWNLOAD_MANIFEST, UPLOAD_MANIFEST) or name.endswith(".json.tmp"))
+
+
+#yields (relative path, attributes) for every file below remote_dir, descending into sub folders
+def walk_remote(client: SFTPClient, remote_dir: str, relative_dir: str = ""):
+    for attrs in client.listdir_attr(posixpath.join(remote_dir, relative_dir)):
+        relative_path = posixpath.join(relative_dir, attrs.filename)
+        if stat.S_ISDIR(attrs.st_mode):
+            yield from walk_remote(client, remote_dir, relative_path)
+        elif _sync_file(attrs.filename):
+            yield relative_path, attrs
+
+
+#yields (relative path, os.stat_result) for every file below local_dir
+def walk_local(local_dir: str):
+    for root, _, files in os.walk(local_dir):
+        for name in files:
+            if _sync_file(name):
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, local_dir).replace(os.sep, "/"), os.stat(path)
+
+
+def makedirs_remote(client: SFTPClient, remote_dir: str) -> None:
+    if remote_dir in ("", "/", "."):
+        return
+    try:
+        client.stat(remote_dir)
+    except FileNotFoundError:
+        makedirs_remote(client, posixpath.dirname(remote_dir))
+        client.mkdir(remote_dir)
+
+
+#downloads into a .part file next to local_path, continuing from its current length when offset is given
+def download_resumable(client: SFTPClient, remote_path: str, local_path: str, size: int, mtime: int, offset: int = 0) -> int:
+    partial_path = local_path + PARTIAL_SUFFIX
+    with client.open(remote_path, "rb") as remote_file, open(partial_path, "ab" if offset else "wb") as local_file:
+        remote_file.seek(offset)
+        remote_file.prefetch(size) # prefetch starts at the seek position
+        while True:
+            block = remote_file.read(SYNC_BLOCK_SIZE)
+            if not block:
+                break
+            local_file.write(block)
+    os.replace(partial_path, local_path)
+    os.utime(local_path, (mtime, mtime))
+    return size - offset
+
+
+#uploads into a .part file next to remote_path, continuing from its current length when offset is given
+def upload_resumable(client: SFTPClient, local_path: str, remote_path: str, mtime: int, offset: int = 0) -> int:
+    partial_path = remote_path + PARTIAL_SUFFIX
+    sent = 0
+    with open(local_path, "rb") as local_file, client.open(partial_path, "r+b" if offset else "wb") as remote_file:
+        remote_file.set_pipelined(True)
+        local_file.seek(offset)
+        remote_file.seek(offset)
+        while True:
+            block = local_file.read(SYNC_BLOCK_SIZE)
+            if not block:
+                break
+            remote_file.write(block)
+            sent += len(block)
+    # paramiko doesn't report errors for the last pipelined writes, so a short .part is only caught by its size
+    written = client.stat(partial_path).st_size
+    if written != offset + sent:
+        raise IOError(f"size mismatch uploading {remote_path}: {written} bytes written, expected {offset + sent}")
+    client.utime(partial_path, (mtime, mtime))
+    try:
+        client.posix_rename(partial_path, remote_path)
+    except IOError: # server without the posix-rename extension, plain rename refuses to overwrite
+        try:
+            client.remove(remote_path)
+        except FileNotFoundError:
+            pass
+        client.rename(partial_path, remote_path)
+    return sent
+
+
+#incremental directory sync: only files whose size or mtime differs from the manifest are transferred,
+#interrupted transfers resume from the length of their .part file on the next run
+class SFTPSync():
+    def __init__(self, client: SFTPClient, manifest_path: str, max_workers: int = 1):
+        self.client = client
+        self.manifest = SyncManifest(manifest_path)
+        self.max_workers = max_workers
+        self.skipped = 0
+
+    def download(self, remote_dir: str, local_dir: str) -> TransferSummary:
+        jobs = []
+        self.skipped = 0
+        for relative_path, attrs in walk_remote(self.client, remote_dir):
+            local_path = os.path.join(local_dir, *relative_path.split("/"))
+            if self.manifest.unchanged(relative_path, attrs.st_size, attrs.st_mtime) and os.path.exists(local_path):
+                self.skipped += 1
+                continue
+            jobs.append((relative_path, posixpath.join(remote_dir, relative_path), local_path, attrs.st_size, attrs.st_mtime))
+        return self._run(jobs, self._download)
+
+    def upload(self, local_dir: str, remote_dir: str) -> TransferSummary:
+        jobs = []
+        self.skipped = 0
+        for relative_path, local_stat in walk_local(local_dir):
+            mtime = int(local_stat.st_mtime)
+            if self.manifest.unchanged(relative_path, local_stat.st_size, mtime):
+                self.skipped += 1
+                continue
+            jobs.append((relative_path, os.path.join(local_dir, *relative_path.split("/")), posixpath.join(remote_dir, relative_path), local_stat.st_size, mtime))
+        for remote_subdir in sorted({posixpath.dirname(job[2]) for job in jobs}):
+            makedirs_remote(self.client, remote_subdir)
+        return self._run(jobs, self._upload)
+
+    def _download(self, client: SFTPClient, relative_path: str, remote_path: str, local_path: str, size: int, mtime: int) -> TransferResult:
+        start = time.perf_counter()
+        try:
+            partial_path = local_path + PARTIAL_SUFFIX
+            offset = 0
+            if self.manifest.resumable(relative_path, size, mtime) and os.path.exists(partial_path):
+                offset = min(os.path.getsize(partial_path), size)
+            else:
+                self.manifest.start(relative_path, size, mtime)
+            os.makedirs(os.path.dirname(local_path) or ".", exist_ok=True)
+            moved = download_resumable(client, remote_path, local_path, size, mtime, offset)
+            self.manifest.complete(relative_path, size, mtime)
+            return TransferResult("download", remote_path, local_path, moved, time.perf_counter() - start)
+        except Exception as e:
+            return TransferResult("download", remote_path, local_path, seconds=time.perf_counter() - start, error=e)
+
+    def _upload(self, client: SFTPClient, relative_path: str, local_path: str, remote_path: str, size: int, mtime: int) -> TransferResult:
+        start = time.perf_counter()
+        try:
+            offset = 0
+            if self.manifest.resumable(relative_path, size, mtime):
+                try:
+                    offset = min(client.stat(remote_path + PARTIAL_SUFFIX).st_size, size)
+                except FileNotFoundError:
+                    pass
+            else:
+                self.manifest.start(relative_path, size, mtime)
+            moved = upload_resumable(client, local_path, remote_path, mtime, offset)
+            self.manifest.complete(relative_path, size, mtime)
+            return TransferResult("upload", local_path, remote_path, moved, time.perf_counter() - start)
+        except Exception as e:
+            return TransferResult("upload", local_path, remote_path, seconds=time.perf_counter() - start, error=e)
+
+    #runs the jobs on this client, or over a pool of extra channels when max_workers > 1
+    def _run(self, jobs: list, transfer) -> TransferSummary:
+        start = time.perf_counter()
+        if self.max_workers > 1 and len(jobs) > 1:
+            with SFTPTransferPool(self.client.get_channel().get_transport(), min(self.max_workers, len(jobs))) as pool:
+                def pooled(job):
+                    with pool.client() as client:
+                        return transfer(client, *job)
+                with ThreadPoolExecutor(max_workers=pool.channels) as executor:
+                    results = list(executor.map(pooled, jobs))
+        else:
+            results = [transfer(self.client, *job) for job in jobs]
+        return TransferSummary(results, time.perf_counter() - start)
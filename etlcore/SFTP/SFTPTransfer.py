@@ -0,0 +1,111 @@
+import os, time, queue
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import paramiko
+from paramiko import SFTPClient
+
+TRANSFER_WINDOW_SIZE = 64 * 1024 * 1024 # large SSH window so a channel isn't stalled waiting for window adjusts
+TRANSFER_PACKET_SIZE = 32 * 1024 # largest SFTP payload most servers accept
+
+
+class TransferResult():
+    def __init__(self, direction: str, source: str, destination: str, size: int = 0, seconds: float = 0.0, error: Exception = None):
+        self.direction = direction
+        self.source = source
+        self.destination = destination
+        self.size = size
+        self.seconds = seconds
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.size / 1024 ** 2 / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        if self.error is not None:
+            return f"{self.direction} {self.source} -> {self.destination} failed: {str(self.error)}"
+        return f"{self.direction} {self.source} -> {self.destination}: {self.size} bytes in {self.seconds:.2f}s ({self.mb_per_second:.2f} MB/s)"
+
+
+class TransferSummary():
+    def __init__(self, results: list, seconds: float):
+        self.results = results
+        self.seconds = seconds
+
+    @property
+    def failed(self) -> list:
+        return [r for r in self.results if not r.ok]
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(r.size for r in self.results if r.ok)
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.total_bytes / 1024 ** 2 / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        return f"{len(self.results) - len(self.failed)}/{len(self.results)} files, {self.total_bytes} bytes in {self.seconds:.2f}s ({self.mb_per_second:.2f} MB/s)"
+
+
+#Several SFTP channels opened over one SSH transport, files are moved over them concurrently by a bounded thread pool
+#downloads use paramiko's prefetch so many read requests are in flight at once, uploads use pipelined writes
+class SFTPTransferPool():
+    def __init__(self, transport: paramiko.Transport, channels: int = 4, window_size: int = TRANSFER_WINDOW_SIZE,
+                 max_packet_size: int = TRANSFER_PACKET_SIZE):
+        self.channels = channels
+        self._clients = queue.Queue()
+        self._opened = []
+        for _ in range(channels):
+            client = SFTPClient.from_transport(transport, window_size=window_size, max_packet_size=max_packet_size)
+            self._opened.append(client)
+            self._clients.put(client)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        for client in self._opened:
+            client.close()
+
+    #borrows a channel for one transfer
+    @contextmanager
+    def client(self):
+        client = self._clients.get()
+        try:
+            yield client
+        finally:
+            self._clients.put(client)
+
+    def download(self, remote_path: str, local_path: str) -> TransferResult:
+        start = time.perf_counter()
+        try:
+            with self.client() as client:
+                client.get(remote_path, local_path, prefetch=True)
+            return TransferResult("download", remote_path, local_path, os.path.getsize(local_path), time.perf_counter() - start)
+        except Exception as e:
+            return TransferResult("download", remote_path, local_path, seconds=time.perf_counter() - start, error=e)
+
+    def upload(self, local_path: str, remote_path: str) -> TransferResult:
+        start = time.perf_counter()
+        try:
+            with self.client() as client:
+                attrs = client.put(local_path, remote_path, confirm=True) # putfo pipelines the writes
+            return TransferResult("upload", local_path, remote_path, attrs.st_size, time.perf_counter() - start)
+        except Exception as e:
+            return TransferResult("upload", local_path, remote_path, seconds=time.perf_counter() - start, error=e)
+
+    #jobs are (source, destination) pairs all going the same direction, "upload" or "download"
+    def run(self, direction: str, jobs: list, max_workers: int = None) -> TransferSummary:
+        transfer = self.upload if direction == "upload" else self.download
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_workers or self.channels) as pool:
+            results = list(pool.map(lambda job: transfer(*job), jobs))
+        return TransferSummary(results, time.perf_counter() - start)
@@ -1,14 +1,22 @@
 import os
+import json
+import time
+import uuid
 from office365.runtime.auth.client_credential import ClientCredential
 from office365.runtime.auth.user_credential import UserCredential
 from office365.sharepoint.client_context import ClientContext
 
+UPLOAD_CHUNK_SIZE = 10 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_STATE_SUFFIX = ".sp_upload.json"
+
 class Sharepoint():
     def __init__(self, auth_type: str, credentials: UserCredential | ClientCredential, site: str):
         
         self.auth_type = auth_type
         self.credentials = credentials
         self.site = site
+        self.last_transfer = None
         self.sp_ctx_connection = self._create_sharepoint_connection()
         print(f"Connected to Sharepoint using {self.auth_type}")
 
@@ -41,6 +49,96 @@ class Sharepoint():
         except Exception as e:
             return f"Failed to download file {remote_filename} from {sp_folder} to {local_file_path}"
         
+    #uploads through a chunked upload session so the file is never fully in memory, one request per chunk_size bytes
+    #progress (upload id and confirmed offset) is kept next to the local file, calling again after a failure resumes from
+    #the last confirmed chunk as long as the local file hasn't changed, a session the server no longer knows starts over
+    #on_progress(bytes_done, total_bytes) is called after every chunk
+    def upload_large_file_to_sharepoint(self, sp_folder: str, local_file_path: str, chunk_size: int = UPLOAD_CHUNK_SIZE, on_progress=None):
+        try:
+            filename = os.path.basename(local_file_path)
+            size = os.path.getsize(local_file_path)
+            mtime = os.path.getmtime(local_file_path)
+            state_path = local_file_path + UPLOAD_STATE_SUFFIX
+            state = None
+            if os.path.exists(state_path):
+                with open(state_path, "r") as f:
+                    state = json.load(f)
+                if state.get("size") != size or state.get("mtime") != mtime:
+                    state = None # the file changed since the interrupted upload
+
+            start = time.perf_counter()
+            try:
+                sent = self._upload_chunks(sp_folder, local_file_path, filename, size, mtime, chunk_size, state, state_path, on_progress)
+            except Exception as e:
+                if state is None:
+                    raise
+                print(f"Could not resume upload of {filename} ({str(e)}), starting over")
+                sent = self._upload_chunks(sp_folder, local_file_path, filename, size, mtime, chunk_size, None, state_path, on_progress)
+            self._record_transfer(filename, sent, time.perf_counter() - start)
+            if os.path.exists(state_path):
+                os.remove(state_path)
+            print(f"Uploaded {filename} to sharepoint: {self.last_transfer['mb_per_second']:.2f} MB/s")
+            return True
+        except Exception as e:
+            return f"Failed to upload file {local_file_path} to sharepoint: {str(e)}"
+
+    def _upload_chunks(self, sp_folder, local_file_path, filename, size, mtime, chunk_size, state, state_path, on_progress) -> int:
+        target_folder = self.sp_ctx_connection.web.get_folder_by_server_relative_url(sp_folder)
+        if size <= chunk_size: # one request is all a session would do anyway
+            with open(local_file_path, "rb") as content_file:
+                target_folder.upload_file(filename, content_file.read())
+            self.sp_ctx_connection.execute_query()
+            if on_progress:
+                on_progress(size, size)
+            return size
+
+        if state is None:
+            target_folder.upload_file(filename, b"") # the session writes into an existing (empty) file
+            self.sp_ctx_connection.execute_query()
+            state = {"upload_id": str(uuid.uuid4()), "offset": 0, "size": size, "mtime": mtime}
+        target_file = self.sp_ctx_connection.web.get_file_by_server_relative_url(os.path.join(sp_folder, filename))
+        upload_id = state["upload_id"]
+        offset = resumed = state["offset"]
+
+        with open(local_file_path, "rb") as content_file:
+            content_file.seek(offset)
+            while offset < size:
+                chunk = content_file.read(chunk_size)
+                if offset == 0:
+                    result = target_file.start_upload(upload_id, chunk)
+                elif offset + len(chunk) >= size:
+                    target_file.finish_upload(upload_id, offset, chunk)
+                    result = None
+                else:
+                    result = target_file.continue_upload(upload_id, offset, chunk)
+                self.sp_ctx_connection.execute_query()
+                offset = result.value if result is not None and result.value else offset + len(chunk)
+                state["offset"] = offset
+                with open(state_path, "w") as f:
+                    json.dump(state, f)
+                if on_progress:
+                    on_progress(offset, size)
+        return size - resumed
+
+    #streams the file to disk chunk_size bytes at a time instead of buffering the whole response
+    #on_progress(bytes_done) is called after every chunk
+    def download_large_file_from_sharepoint(self, sp_folder: str, remote_filename: str, local_file_path: str, chunk_size: int = DOWNLOAD_CHUNK_SIZE, on_progress=None):
+        try:
+            remote_path = os.path.join(sp_folder, remote_filename) #file on sharepoint
+            destination_path = os.path.join(local_file_path, os.path.basename(remote_filename)) #destination location for file
+            start = time.perf_counter()
+            with open(destination_path, "wb") as local_file:
+                self.sp_ctx_connection.web.get_file_by_server_relative_url(remote_path).download_session(local_file, on_progress, chunk_size).execute_query()
+            self._record_transfer(remote_filename, os.path.getsize(destination_path), time.perf_counter() - start)
+            print(f"Downloaded {remote_filename} from sharepoint: {self.last_transfer['mb_per_second']:.2f} MB/s")
+            return True
+        except Exception as e:
+            return f"Failed to download file {remote_filename} from {sp_folder} to {local_file_path}: {str(e)}"
+
+    def _record_transfer(self, filename: str, size: int, seconds: float) -> None:
+        self.last_transfer = {"file": filename, "bytes": size, "seconds": seconds,
+                              "mb_per_second": size / 1024 ** 2 / seconds if seconds else 0.0}
+
     def get_folder_contents(self, relative_url):
         try:
             libraryRoot = self.sp_ctx_connection.web.get_folder_by_server_relative_url(relative_url)
@@ -0,0 +1,176 @@
+import os
+import socket
+import threading
+
+import paramiko
+import pytest
+from paramiko import (AUTH_SUCCESSFUL, OPEN_SUCCEEDED, SFTP_FAILURE, SFTP_OK, ServerInterface, SFTPAttributes, SFTPHandle,
+                      SFTPServer, SFTPServerInterface)
+
+HOST_KEY = paramiko.RSAKey.generate(1024)
+
+
+class _Server(ServerInterface):
+    def check_auth_password(self, username, password):
+        return AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        return OPEN_SUCCEEDED
+
+
+#file handle that can be told to fail reads or writes past an offset, to cut a transfer off part way
+class _Handle(SFTPHandle):
+    def __init__(self, flags, faults):
+        super().__init__(flags)
+        self.faults = faults
+
+    def read(self, offset, length):
+        if self.faults.get("read_from") is not None and offset + length > self.faults["read_from"]:
+            return SFTP_FAILURE
+        return super().read(offset, length)
+
+    def write(self, offset, data):
+        if self.faults.get("write_from") is not None and offset + len(data) > self.faults["write_from"]:
+            return SFTP_FAILURE
+        return super().write(offset, data)
+
+    def stat(self):
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return SFTP_OK
+
+
+#serves the directory root, every path the client sends is taken relative to it
+class _Files(SFTPServerInterface):
+    def __init__(self, server, root, faults):
+        super().__init__(server)
+        self.root = root
+        self.faults = faults
+
+    def _local(self, path):
+        return os.path.join(self.root, self.canonicalize(path).lstrip("/"))
+
+    def _call(self, action, *args):
+        try:
+            action(*args)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def list_folder(self, path):
+        try:
+            local = self._local(path)
+            entries = []
+            for name in os.listdir(local):
+                attrs = SFTPAttributes.from_stat(os.stat(os.path.join(local, name)))
+                attrs.filename = name
+                entries.append(attrs)
+            return entries
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(self._local(path)))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(self._local(path), flags, 0o666)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+        handle = _Handle(flags, self.faults)
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def remove(self, path):
+        return self._call(os.remove, self._local(path))
+
+    def rename(self, oldpath, newpath):
+        if os.path.exists(self._local(newpath)):
+            return SFTP_FAILURE # plain SFTP rename doesn't overwrite
+        return self._call(os.rename, self._local(oldpath), self._local(newpath))
+
+    def posix_rename(self, oldpath, newpath):
+        return self._call(os.replace, self._local(oldpath), self._local(newpath))
+
+    def mkdir(self, path, attr):
+        return self._call(os.mkdir, self._local(path))
+
+    def rmdir(self, path):
+        return self._call(os.rmdir, self._local(path))
+
+    def chattr(self, path, attr):
+        if attr.st_mtime is not None:
+            return self._call(os.utime, self._local(path), (attr.st_atime, attr.st_mtime))
+        return SFTP_OK
+
+
+class SFTPTestServer():
+    def __init__(self, root):
+        self.root = str(root)
+        self.faults = {} # "read_from" / "write_from": byte offset past which reads / writes fail
+        self._socket = socket.socket()
+        self._socket.bind(("127.0.0.1", 0))
+        self._socket.listen(5)
+        self.port = self._socket.getsockname()[1]
+        self._transports = []
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                return # closed
+            transport = paramiko.Transport(connection)
+            transport.add_server_key(HOST_KEY)
+            transport.set_subsystem_handler("sftp", SFTPServer, _Files, self.root, self.faults)
+            transport.start_server(server=_Server())
+            self._transports.append(transport)
+
+    def connect(self):
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh.connect("127.0.0.1", port=self.port, username="etl", password="etl", allow_agent=False, look_for_keys=False)
+        return ssh
+
+    def close(self):
+        self._socket.close()
+        for transport in self._transports:
+            transport.close()
+
+
+#an in-process SFTP server over a temporary directory, and a client connected to it
+@pytest.fixture
+def sftp_server(tmp_path):
+    root = tmp_path / "server"
+    root.mkdir()
+    server = SFTPTestServer(root)
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def sftp_client(sftp_server):
+    ssh = sftp_server.connect()
+    client = ssh.open_sftp()
+    yield client
+    client.close()
+    ssh.close()
@@ -0,0 +1,82 @@
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.dialects.mssql import DATETIME2, SMALLDATETIME
+from sqlalchemy.types import Boolean, Date, DateTime, Float, Integer, String
+
+from etlcore.DataUtils.DataUtils import ConversionPlan
+from etlcore.DB.Loaders import AdaptiveChunkLoader, BulkFileLoader, ExecuteManyLoader, ToSqlLoader, TruncateReuseLoader
+
+DTYPES = {"id": Integer(), "name": String(20)}
+
+
+def frame(rows: int, offset: int = 0) -> pd.DataFrame:
+    return pd.DataFrame({"id": range(offset, offset + rows), "name": [f"row {i}" for i in range(offset, offset + rows)]})
+
+
+@pytest.fixture
+def engine(tmp_path):
+    # same AUTOCOMMIT setup the engine registry uses
+    return create_engine(f"sqlite:///{tmp_path / 'stage.db'}", execution_options={"isolation_level": "AUTOCOMMIT"})
+
+
+def count(con, table: str = "RAW_t") -> int:
+    return con.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+
+
+@pytest.mark.parametrize("loader", [ToSqlLoader(chunksize=100), AdaptiveChunkLoader(), ExecuteManyLoader(batch_size=300), TruncateReuseLoader()],
+                         ids=lambda loader: loader.name)
+def test_load_row_counts(engine, loader):
+    with engine.connect() as con:
+        result = loader.load(con, frame(1000), None, "RAW_t", DTYPES)
+        assert result.rows == 1000
+        assert count(con) == 1000
+        assert con.execute(text("SELECT name FROM RAW_t WHERE id = 999")).scalar() == "row 999"
+
+        # a second load replaces the rows instead of adding to them
+        loader.load(con, frame(250, offset=5000), None, "RAW_t", DTYPES)
+        assert count(con) == 250
+        assert con.execute(text("SELECT MIN(id) FROM RAW_t")).scalar() == 5000
+
+
+def test_executemany_keeps_missing_values_as_null(engine):
+    df = pd.DataFrame({"id": [1, None, 3], "name": ["a", None, "c"]})
+    with engine.connect() as con:
+        ExecuteManyLoader().load(con, df, None, "RAW_t", DTYPES)
+        assert con.execute(text("SELECT COUNT(*) FROM RAW_t WHERE id IS NULL AND name IS NULL")).scalar() == 1
+
+
+def test_truncate_reuse_keeps_the_existing_table(engine):
+    with engine.connect() as con:
+        TruncateReuseLoader().load(con, frame(100), None, "RAW_t", DTYPES)
+        con.execute(text("CREATE INDEX ix_raw_t_id ON RAW_t (id)"))
+
+        TruncateReuseLoader().load(con, frame(40, offset=100), None, "RAW_t", DTYPES)
+        assert count(con) == 40
+        assert con.execute(text("SELECT MIN(id) FROM RAW_t")).scalar() == 100
+        # the table was emptied, not dropped, so its index survived
+        assert [ix["name"] for ix in inspect(con).get_indexes("RAW_t")] == ["ix_raw_t_id"]
+
+
+def test_to_sql_replace_drops_the_existing_table(engine):
+    with engine.connect() as con:
+        ToSqlLoader().load(con, frame(10), None, "RAW_t", DTYPES)
+        con.execute(text("CREATE INDEX ix_raw_t_id ON RAW_t (id)"))
+        ToSqlLoader().load(con, frame(10), None, "RAW_t", DTYPES)
+        assert inspect(con).get_indexes("RAW_t") == []
+
+
+def test_bulk_file_csv_matches_the_column_types(tmp_path):
+    dtypes = {"flag": Boolean(), "n": Integer(), "dt": DateTime(), "sdt": SMALLDATETIME(), "dt2": DATETIME2(), "d": Date(),
+              "f": Float(53), "s": String(10)}
+    raw = pd.DataFrame({"flag": ["Yes", "No", None], "n": ["5", "", None],
+                        "dt": ["2024-01-01 10:00:00.123456", None, None], "sdt": ["2024-01-01 10:00", None, None],
+                        "dt2": ["2024-01-01 10:00:00.123456", None, None], "d": ["2024-01-01", None, None],
+                        "f": ["1.5", None, None], "s": ["a,b", None, "c"]})
+    df = ConversionPlan(dtypes).apply(raw) # bit and int columns come out as float64
+
+    path = tmp_path / "bulk.csv"
+    BulkFileLoader(str(tmp_path)).write_csv(df, dtypes, str(path))
+    assert path.read_text() == ('1,5,2024-01-01 10:00:00.123,2024-01-01 10:00:00.000,2024-01-01 10:00:00.123456,2024-01-01,1.5,"a,b"\n'
+                                "0,,,,,,,\n"
+                                ",,,,,,,c\n")
@@ -0,0 +1,54 @@
+import pandas as pd
+import pytest
+from sqlalchemy import inspect, text
+from sqlalchemy.types import Integer, String
+
+from etlcore.DB.DB import DB
+from etlcore.DB.Loaders import AdaptiveChunkLoader, ExecuteManyLoader, StagingLoader, ToSqlLoader, TruncateReuseLoader
+
+DTYPES = {"id": Integer(), "name": String(20)}
+
+
+@pytest.fixture
+def db(tmp_path):
+    return DB(f"sqlite:///{tmp_path / 'stage.db'}?timeout=30", "test")
+
+
+def frame(rows: int) -> pd.DataFrame:
+    return pd.DataFrame({"id": range(rows), "name": [f"row {i}" for i in range(rows)]})
+
+
+@pytest.mark.parametrize("loader", [None, ToSqlLoader(), AdaptiveChunkLoader(), ExecuteManyLoader(), TruncateReuseLoader()],
+                         ids=lambda loader: loader.name if loader else "default")
+def test_every_partition_is_appended(db, loader):
+    assert db.load_to_staging_parallel(frame(500), None, "q", DTYPES, max_workers=4, partition_rows=37, loader=loader) is True
+    assert len(db.last_partitions) == 14
+    with db.connection() as con:
+        assert con.execute(text("SELECT COUNT(*), COUNT(DISTINCT id) FROM RAW_q")).fetchone() == (500, 500)
+
+
+def test_truncate_reuse_keeps_the_staging_table(db):
+    assert db.load_to_staging_parallel(frame(100), None, "q", DTYPES, loader=TruncateReuseLoader()) is True
+    with db.connection() as con:
+        con.execute(text("CREATE INDEX ix_raw_q_id ON RAW_q (id)"))
+
+    assert db.load_to_staging_parallel(frame(500), None, "q", DTYPES, max_workers=4, partition_rows=37, loader=TruncateReuseLoader()) is True
+    with db.connection() as con:
+        assert con.execute(text("SELECT COUNT(*) FROM RAW_q")).scalar() == 500
+        assert [ix["name"] for ix in inspect(con).get_indexes("RAW_q")] == ["ix_raw_q_id"]
+
+def test_partitions_from_an_iterator(db):
+    chunks = (frame(500).iloc[i:i + 100] for i in range(0, 500, 100))
+    assert db.load_to_staging_parallel(chunks, None, "q", DTYPES, max_workers=3) is True
+    assert db.last_load.rows == 500
+
+
+def test_loader_that_cannot_append_is_rejected(db):
+    class ReplaceOnly(StagingLoader):
+        name = "replace_only"
+
+        def _load(self, con, df, schema, table_name, dtype_dict):
+            df.to_sql(name=table_name, con=con, schema=schema, if_exists="replace", index=False)
+
+    with pytest.raises(ValueError):
+        db.load_to_staging_parallel(frame(10), None, "q", DTYPES, loader=ReplaceOnly())
@@ -0,0 +1,64 @@
+import io
+import pytest
+from sqlalchemy import inspect, text
+from sqlalchemy.types import Integer, String
+
+from etlcore.DB.DB import DB
+from etlcore.DB.Loaders import AdaptiveChunkLoader, ExecuteManyLoader, StagingLoader, ToSqlLoader, TruncateReuseLoader
+from etlcore.DataUtils.DataUtils import DataUtils
+from etlcore.DataUtils.Pipeline import ChunkedPipeline, csv_chunks
+
+DTYPES = {"id": Integer(), "name": String(20)}
+
+
+class TableColumns():
+    # stands in for SchemaCache, sqlite has no INFORMATION_SCHEMA
+    def get_columns(self, db, schema, table_name):
+        return list(DTYPES)
+
+
+@pytest.fixture
+def db(tmp_path):
+    return DB(f"sqlite:///{tmp_path / 'stage.db'}", "test")
+
+
+def csv_source(rows: int) -> io.BytesIO:
+    lines = ["id,name,extra"] + [f"{i},row {i},x" for i in range(rows)]
+    return io.BytesIO("\n".join(lines).encode())
+
+
+@pytest.mark.parametrize("loader", [None, ToSqlLoader(), AdaptiveChunkLoader(), ExecuteManyLoader(), TruncateReuseLoader()],
+                         ids=lambda loader: loader.name if loader else "default")
+def test_every_chunk_is_appended(db, loader):
+    pipeline = ChunkedPipeline(db, DataUtils(db.engine, "test", schema_cache=TableColumns()), loader)
+    assert pipeline.run(csv_chunks(csv_source(1000), chunksize=100), "db", "dbo", "t", None, dict(DTYPES)) is True
+    assert len(pipeline.chunk_results) == 10
+    with db.connection() as con:
+        assert con.execute(text("SELECT COUNT(*), COUNT(DISTINCT id) FROM RAW_t")).fetchone() == (1000, 1000)
+        assert [r[1] for r in con.execute(text("PRAGMA table_info(RAW_t)"))] == ["id", "name"]
+
+
+def test_truncate_reuse_keeps_the_staging_table(db):
+    pipeline = ChunkedPipeline(db, DataUtils(db.engine, "test", schema_cache=TableColumns()), TruncateReuseLoader())
+    assert pipeline.run(csv_chunks(csv_source(100), chunksize=50), "db", "dbo", "t", None, dict(DTYPES)) is True
+    with db.connection() as con:
+        con.execute(text("CREATE INDEX ix_raw_t_id ON RAW_t (id)"))
+
+    assert pipeline.run(csv_chunks(csv_source(1000), chunksize=100), "db", "dbo", "t", None, dict(DTYPES)) is True
+    with db.connection() as con:
+        assert con.execute(text("SELECT COUNT(*) FROM RAW_t")).scalar() == 1000
+        assert [ix["name"] for ix in inspect(con).get_indexes("RAW_t")] == ["ix_raw_t_id"]
+
+def test_running_string_widths(db):
+    pipeline = ChunkedPipeline(db, DataUtils(db.engine, "test", schema_cache=TableColumns()), string_widths="running")
+    assert pipeline.run(csv_chunks(csv_source(1000), chunksize=100), "db", "dbo", "t", None, dict(DTYPES)) is True
+    assert pipeline.dtype_dict["name"].length == len("row 999")
+    assert pipeline.last_load.rows == 1000
+
+
+def test_loader_that_cannot_append_is_rejected(db):
+    class ReplaceOnly(StagingLoader):
+        name = "replace_only"
+
+    with pytest.raises(ValueError):
+        ChunkedPipeline(db, DataUtils(db.engine, "test"), ReplaceOnly())
@@ -0,0 +1,52 @@
+import boto3
+import pytest
+
+moto = pytest.importorskip("moto")
+
+from etlcore.S3.S3 import S3
+
+BUCKET = "etl-drops"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        boto3.client("s3").create_bucket(Bucket=BUCKET)
+        yield S3("key", "secret", BUCKET)
+
+
+def put(s3, keys):
+    for key in keys:
+        s3.s3_client.put_object(Bucket=BUCKET, Key=key, Body=key.encode())
+
+
+def keys(s3, prefix):
+    return sorted(o["Key"] for o in s3.iter_files(prefix))
+
+
+def test_move_into_a_sub_folder_of_the_source(s3):
+    put(s3, [f"in/{i:04d}.csv" for i in range(1500)])
+    put(s3, ["in/archive/old.csv"])
+
+    result = s3.move_prefix("in/", "in/archive/")
+    assert not result.failed
+    assert len(result.succeeded) == 1500
+    assert keys(s3, "in/archive/archive/") == []
+    assert keys(s3, "in/archive/") == sorted(["in/archive/old.csv"] + [f"in/archive/{i:04d}.csv" for i in range(1500)])
+    assert len(keys(s3, "in/")) == 1501
+
+
+def test_copy_keeps_the_source(s3):
+    put(s3, ["in/a.csv", "in/sub/b.csv"])
+    result = s3.copy_prefix("in/", "copy/")
+    assert sorted(result.succeeded) == ["in/a.csv", "in/sub/b.csv"]
+    assert keys(s3, "copy/") == ["copy/a.csv", "copy/sub/b.csv"]
+    assert keys(s3, "in/") == ["in/a.csv", "in/sub/b.csv"]
+
+
+def test_delete_in_batches(s3):
+    put(s3, [f"done/{i:04d}.csv" for i in range(2100)])
+    result = s3.delete_prefix("done/")
+    assert len(result.succeeded) == 2100
+    assert keys(s3, "done/") == []
@@ -0,0 +1,37 @@
+import boto3
+import pytest
+
+moto = pytest.importorskip("moto")
+
+from etlcore.S3.S3 import S3
+
+BUCKET = "etl-drops"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        boto3.client("s3").create_bucket(Bucket=BUCKET)
+        yield S3("key", "secret", BUCKET)
+
+
+def put(s3, keys):
+    for key in keys:
+        s3.s3_client.put_object(Bucket=BUCKET, Key=key, Body=key.encode())
+
+
+def test_one_index_tracks_several_prefixes(s3, tmp_path):
+    index_path = str(tmp_path / "index.json")
+    put(s3, ["in/a/1.csv", "in/b/1.csv", "out/a/1.csv"])
+
+    assert sorted(s3.list_changes(index_path, "in/").new) == ["in/a/1.csv", "in/b/1.csv"]
+    assert s3.list_changes(index_path, "out/").new == ["out/a/1.csv"]
+    # refreshing out/ must not have dropped the partitions under in/
+    assert not s3.list_changes(index_path, "in/")
+
+    s3.s3_client.delete_object(Bucket=BUCKET, Key="in/b/1.csv")
+    put(s3, ["in/a/2.csv"])
+    changes = s3.list_changes(index_path, "in/")
+    assert (changes.new, changes.deleted) == (["in/a/2.csv"], ["in/b/1.csv"])
+    assert not s3.list_changes(index_path, "out/")
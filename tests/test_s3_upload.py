@@ -0,0 +1,79 @@
+import io
+
+import boto3
+import numpy as np
+import pandas as pd
+import pytest
+
+moto = pytest.importorskip("moto")
+
+from etlcore.S3.S3 import S3
+from etlcore.S3.S3Transfer import MULTIPART_MIN_CHUNK_SIZE, MultipartWriter
+
+BUCKET = "etl-drops"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        boto3.client("s3").create_bucket(Bucket=BUCKET)
+        yield S3("key", "secret", BUCKET, chunk_size=MULTIPART_MIN_CHUNK_SIZE)
+
+
+def frame(rows: int) -> pd.DataFrame:
+    return pd.DataFrame({"id": np.arange(rows), "amount": np.arange(rows) / 7, "name": [f"row {i:08d}" for i in range(rows)]})
+
+
+def get(s3, key: str) -> bytes:
+    return s3.s3_client.get_object(Bucket=BUCKET, Key=key)["Body"].read()
+
+
+def parts(s3, key: str) -> int:
+    etag = s3.s3_client.head_object(Bucket=BUCKET, Key=key)["ETag"].strip('"')
+    return int(etag.rsplit("-", 1)[1]) # multipart ETags end in -<part count>
+
+
+def incomplete_uploads(s3) -> list:
+    return s3.s3_client.list_multipart_uploads(Bucket=BUCKET).get("Uploads", [])
+
+
+def test_csv_round_trip(s3):
+    df = frame(400000) # ~17 MB of CSV, several parts
+    assert s3.upload_dataframe(df, "out/frame.csv") == "out/frame.csv"
+    assert parts(s3, "out/frame.csv") > 1
+    pd.testing.assert_frame_equal(pd.read_csv(io.BytesIO(get(s3, "out/frame.csv"))), df)
+    assert s3.last_transfer.transferred == len(get(s3, "out/frame.csv"))
+    assert incomplete_uploads(s3) == []
+
+
+def test_parquet_round_trip(s3):
+    pq = pytest.importorskip("pyarrow.parquet")
+    df = frame(1000)
+    assert s3.upload_dataframe(df, "out/frame.parquet", file_format="parquet") == "out/frame.parquet"
+    pd.testing.assert_frame_equal(pq.read_table(io.BytesIO(get(s3, "out/frame.parquet"))).to_pandas(), df)
+    assert incomplete_uploads(s3) == []
+
+
+def test_empty_frame_is_one_part(s3):
+    assert s3.upload_dataframe(pd.DataFrame({"id": []}), "out/empty.csv") == "out/empty.csv"
+    assert get(s3, "out/empty.csv") == b"id\n"
+    assert parts(s3, "out/empty.csv") == 1
+
+    with MultipartWriter(s3.s3_client, BUCKET, "out/nothing.bin"):
+        pass
+    assert get(s3, "out/nothing.bin") == b""
+    assert incomplete_uploads(s3) == []
+
+
+def test_failed_encoding_aborts_the_upload(s3):
+    class Unprintable():
+        def __str__(self):
+            raise ValueError("can't encode this value")
+
+    df = frame(400000).astype({"name": object})
+    df.loc[len(df) - 1, "name"] = Unprintable() # fails after several parts are already uploaded
+    result = s3.upload_dataframe(df, "out/broken.csv")
+    assert result.startswith("Failed to upload dataframe")
+    assert incomplete_uploads(s3) == []
+    assert s3.s3_client.list_objects_v2(Bucket=BUCKET).get("KeyCount") == 0
@@ -0,0 +1,27 @@
+import json
+import threading
+import time
+
+from requests import Session
+
+from etlcore.CX.CX import SessionStore
+
+
+def test_threads_with_their_own_stores_keep_every_entry(tmp_path):
+    path = str(tmp_path / "sessions.json")
+
+    def save(thread):
+        for i in range(25):
+            # a new store per save, the way CX(..., sessionStore=path) builds one per client
+            SessionStore(path).save("https://cx/", f"user{thread}-{i}", Session(), time.time() + 600)
+
+    threads = [threading.Thread(target=save, args=(t,)) for t in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    with open(path) as f:
+        assert len(json.load(f)) == 200
+    assert [p.name for p in tmp_path.iterdir()] == ["sessions.json"] # no temp or lock files left behind
+    assert SessionStore(path).load("https://cx/", "user3-7") is not None
@@ -0,0 +1,124 @@
+import json
+import os
+
+import pytest
+
+from etlcore.SFTP import SFTPSync as sync_module
+from etlcore.SFTP.SFTPSync import PARTIAL_SUFFIX, SFTPSync
+
+BLOCK = 64 * 1024
+
+
+@pytest.fixture(autouse=True)
+def small_blocks(monkeypatch):
+    # several blocks per file so a transfer can be cut off between them
+    monkeypatch.setattr(sync_module, "SYNC_BLOCK_SIZE", BLOCK)
+
+
+def write(path, data: bytes, mtime: int = 1700000000):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    os.utime(path, (mtime, mtime))
+
+
+def read(path) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def manifest(path) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def test_interrupted_download_resumes_from_the_part_file(sftp_server, sftp_client, tmp_path):
+    data = os.urandom(10 * BLOCK + 123)
+    write(os.path.join(sftp_server.root, "drop", "export.csv"), data)
+    local_dir = str(tmp_path / "local")
+    manifest_path = str(tmp_path / "download.json")
+
+    sftp_server.faults["read_from"] = 4 * BLOCK
+    summary = SFTPSync(sftp_client, manifest_path).download("/drop", local_dir)
+    assert len(summary.failed) == 1
+    partial = os.path.join(local_dir, "export.csv" + PARTIAL_SUFFIX)
+    assert read(partial) == data[:4 * BLOCK]
+    assert not os.path.exists(os.path.join(local_dir, "export.csv"))
+    assert manifest(manifest_path)["partial"] == {"export.csv": {"size": len(data), "mtime": 1700000000}}
+
+    sftp_server.faults.clear()
+    summary = SFTPSync(sftp_client, manifest_path).download("/drop", local_dir)
+    assert not summary.failed
+    assert summary.total_bytes == len(data) - 4 * BLOCK # only the rest was fetched
+    assert read(os.path.join(local_dir, "export.csv")) == data
+    assert not os.path.exists(partial)
+    assert manifest(manifest_path) == {"files": {"export.csv": {"size": len(data), "mtime": 1700000000}}, "partial": {}}
+
+
+def test_partial_download_of_a_changed_file_starts_over(sftp_server, sftp_client, tmp_path):
+    remote_path = os.path.join(sftp_server.root, "drop", "export.csv")
+    write(remote_path, os.urandom(6 * BLOCK))
+    local_dir = str(tmp_path / "local")
+    manifest_path = str(tmp_path / "download.json")
+
+    sftp_server.faults["read_from"] = 2 * BLOCK
+    SFTPSync(sftp_client, manifest_path).download("/drop", local_dir)
+
+    sftp_server.faults.clear()
+    replaced = os.urandom(6 * BLOCK)
+    write(remote_path, replaced, mtime=1700000500) # same size, new mtime
+    summary = SFTPSync(sftp_client, manifest_path).download("/drop", local_dir)
+    assert summary.total_bytes == len(replaced)
+    assert read(os.path.join(local_dir, "export.csv")) == replaced
+
+
+def test_interrupted_upload_resumes_from_the_part_file(sftp_server, sftp_client, tmp_path):
+    data = os.urandom(10 * BLOCK + 77)
+    local_dir = str(tmp_path / "local")
+    write(os.path.join(local_dir, "export.csv"), data)
+    manifest_path = str(tmp_path / "upload.json")
+    sftp_client.mkdir("/inbound")
+
+    sftp_server.faults["write_from"] = 3 * BLOCK
+    summary = SFTPSync(sftp_client, manifest_path).upload(local_dir, "/inbound")
+    assert len(summary.failed) == 1
+    partial = os.path.join(sftp_server.root, "inbound", "export.csv" + PARTIAL_SUFFIX)
+    assert read(partial) == data[:3 * BLOCK]
+    assert "export.csv" in manifest(manifest_path)["partial"]
+
+    sftp_server.faults.clear()
+    summary = SFTPSync(sftp_client, manifest_path).upload(local_dir, "/inbound")
+    assert not summary.failed
+    assert summary.total_bytes == len(data) - 3 * BLOCK
+    assert read(os.path.join(sftp_server.root, "inbound", "export.csv")) == data
+    assert not os.path.exists(partial)
+    assert sftp_client.stat("/inbound/export.csv").st_mtime == int(os.path.getmtime(os.path.join(local_dir, "export.csv")))
+    assert manifest(manifest_path)["partial"] == {}
+
+
+@pytest.mark.parametrize("max_workers", [1, 3])
+def test_nested_directories_round_trip(sftp_server, sftp_client, tmp_path, max_workers):
+    files = {"a.csv": os.urandom(BLOCK), "2024/01/b.csv": os.urandom(3 * BLOCK), "2024/02/c.csv": b"", "2024/02/deep/d.csv": os.urandom(100)}
+    source_dir = str(tmp_path / "source")
+    for relative_path, data in files.items():
+        write(os.path.join(source_dir, *relative_path.split("/")), data)
+    sftp_client.mkdir("/inbound")
+
+    uploader = SFTPSync(sftp_client, str(tmp_path / "upload.json"), max_workers)
+    assert not uploader.upload(source_dir, "/inbound").failed
+    for relative_path, data in files.items():
+        assert read(os.path.join(sftp_server.root, "inbound", *relative_path.split("/"))) == data
+
+    copy_dir = str(tmp_path / "copy")
+    downloader = SFTPSync(sftp_client, str(tmp_path / "download.json"), max_workers)
+    assert not downloader.download("/inbound", copy_dir).failed
+    for relative_path, data in files.items():
+        assert read(os.path.join(copy_dir, *relative_path.split("/"))) == data
+
+    # nothing changed, so the second runs only consult the manifests
+    assert downloader.download("/inbound", copy_dir).results == []
+    assert downloader.skipped == len(files)
+    write(os.path.join(sftp_server.root, "inbound", "2024", "01", "b.csv"), b"changed", mtime=1700000900)
+    summary = downloader.download("/inbound", copy_dir)
+    assert [r.destination for r in summary.results] == [os.path.join(copy_dir, "2024", "01", "b.csv")]
+    assert read(os.path.join(copy_dir, "2024", "01", "b.csv")) == b"changed"
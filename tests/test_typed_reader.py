@@ -0,0 +1,53 @@
+import io
+import pandas as pd
+from sqlalchemy.types import Boolean, DateTime, Float, Integer, String
+
+from etlcore.DataUtils.TypedReader import read_typed_csv
+
+DTYPES = {"id": Integer(), "name": String(20), "created": DateTime()}
+
+
+def source(*dates) -> io.BytesIO:
+    lines = ["id,name,created,extra"] + [f"{i},row {i},{d},x" for i, d in enumerate(dates)]
+    return io.BytesIO("\n".join(lines).encode())
+
+
+def test_columns_are_typed_and_projected():
+    df = read_typed_csv(source("2024-01-01", "2024-01-02"), DTYPES)
+    assert list(df.columns) == ["id", "name", "created"]
+    assert str(df["id"].dtype) == "Int64"
+    assert pd.api.types.is_datetime64_any_dtype(df["created"])
+
+
+def test_mixed_date_formats_are_still_parsed():
+    df = read_typed_csv(source("2024-01-01", "2024-01-02 10:00"), DTYPES)
+    assert pd.api.types.is_datetime64_any_dtype(df["created"])
+    assert df["created"].tolist() == [pd.Timestamp("2024-01-01"), pd.Timestamp("2024-01-02 10:00")]
+
+
+def test_unparseable_dates_become_missing():
+    df = read_typed_csv(source("2024-01-01", "not a date", ""), DTYPES)
+    assert pd.api.types.is_datetime64_any_dtype(df["created"])
+    assert df["created"].isna().tolist() == [False, True, True]
+
+
+def test_bad_integer_falls_back_to_coercion():
+    data = io.BytesIO(b"id,name,created\n1,a,2024-01-01\nfive,b,2024-01-02\n")
+    df = read_typed_csv(data, DTYPES)
+    assert df["id"].isna().tolist() == [False, True]
+
+
+def test_strings_have_one_dtype_on_both_paths():
+    typed = read_typed_csv(source("2024-01-01"), DTYPES)
+    fallback = read_typed_csv(io.BytesIO(b"id,name,created\nfive,b,2024-01-02\n"), DTYPES)
+    assert str(typed["name"].dtype) == str(fallback["name"].dtype) == "string"
+
+
+def test_numbers_and_bits_have_one_dtype_on_both_paths():
+    dtypes = {"id": Integer(), "flag": Boolean(), "amount": Float(53), "created": DateTime()}
+    typed = read_typed_csv(io.BytesIO(b"id,flag,amount,created\n1,Yes,1.5,2024-01-01\n2,No,,2024-01-02\n"), dtypes)
+    fallback = read_typed_csv(io.BytesIO(b"id,flag,amount,created\n1,Yes,x,2024-01-01\n2.5,No,2,2024-01-02\n"), dtypes)
+    assert typed.dtypes.to_dict() == fallback.dtypes.to_dict()
+    assert [str(typed[c].dtype) for c in ("id", "flag", "amount")] == ["Int64", "boolean", "float64"]
+    assert fallback["id"].isna().tolist() == [False, True]
+    assert fallback["flag"].tolist() == [True, False]